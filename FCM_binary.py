@@ -0,0 +1,60 @@
+import numpy as np
+import json
+import os
+
+# single file binary format of a compiled model:
+#   magic (8 bytes), version (uint32), header length (uint32), JSON header, padding, float64 data
+# the header describes the model and the position of each matrix in the data, which is memory-mapped read-only
+magic = b"FCMMODEL"
+version = 1
+alignment = 64
+
+# models already loaded, keyed by absolute path
+_loaded = {}
+
+
+def write_model(path, header, matrices):
+    "Write a header (JSON serializable dict) and a dict name -> 2D array in a single binary file"
+    header = dict(header)
+    header["arrays"] = {}
+    offset = 0
+    for name, matrix in matrices.items():
+        matrix = np.asarray(matrix, dtype=np.float64)
+        header["arrays"][name] = [offset, matrix.shape[0], matrix.shape[1]]
+        offset += matrix.size
+
+    header_bytes = json.dumps(header).encode()
+    data_offset = -(-(16 + len(header_bytes)) // alignment) * alignment
+    with open(path, "wb") as f:
+        f.write(magic)
+        f.write(np.array([version, len(header_bytes)], dtype="<u4").tobytes())
+        f.write(header_bytes)
+        f.write(b"\0" * (data_offset - 16 - len(header_bytes)))
+        for matrix in matrices.values():
+            f.write(np.ascontiguousarray(matrix, dtype="<f8").tobytes())
+
+
+def read_model(path):
+    """Read a file written by write_model, returns the header and a dict name -> read-only matrix.
+    The matrices are views of a memory map of the file, shared by all the processes that load it;
+    the file is read once per process and again only if it changes."""
+    key = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    if key in _loaded and _loaded[key][0] == mtime:
+        return _loaded[key][1]
+
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f"{path} is not a compiled model")
+        file_version, header_length = np.frombuffer(f.read(8), dtype="<u4")
+        if file_version != version:
+            raise ValueError(f"{path} has version {file_version}, expected {version}: compile the model again")
+        header = json.loads(f.read(int(header_length)))
+    data_offset = -(-(16 + int(header_length)) // alignment) * alignment
+
+    size = sum(rows * cols for _, rows, cols in header["arrays"].values())
+    data = np.memmap(path, dtype="<f8", mode="r", offset=data_offset, shape=(size,)) if size > 0 else np.zeros(0)
+    matrices = {name: data[offset:offset + rows * cols].reshape(rows, cols) for name, (offset, rows, cols) in header["arrays"].items()}
+
+    _loaded[key] = (mtime, (header, matrices))
+    return header, matrices
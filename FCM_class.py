@@ -1,17 +1,141 @@
-import networkx as nx
 import numpy as np
 import json
-import matplotlib.pyplot as plt
 from random import randint
 import copy
 import FLT_class
-import pandas as pd
+import FCM_binary
+import FCM_engine
+from FCM_engine import solvers, use_sparse, weight_operator, block_diagonal, run_fcm_blocks, solve_blocks, solve_fixed_point
 import glob
+import hashlib
+import os
 
 model_path = "model"
+compiled_model_file = "model.fcmb"     # compiled model in model_path, see compile_model
 cases_path = "cases"
 colors = ['b', 'g', 'r', 'c', 'm', 'y', 'k', 'w']
 
+# process-level registries of the loaded models and cases
+# path -> (modification times of the files, loaded content)
+_model_registry = {}
+_cases_registry = {}
+
+
+def files_signature(files):
+    "Names and modification times of a list of files, used to invalidate the registries"
+    return tuple((f, os.path.getmtime(f)) for f in sorted(files))
+
+
+def weights_digest(weights):
+    "SHA-256 digest of a weight matrix (shape and values), the key of the sub-FCM in the caches of run_fcm"
+    digest = hashlib.sha256(np.asarray(weights.shape, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(weights, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def load_model(path=None, compiled=True):
+    """Load and validate the sub-FCMs in path (weight matrices and descriptions), model_path by default.
+    path is a model directory or a compiled model file; if compiled is True the compiled model
+    of a directory is used when it is not older than the text files.
+    The model is loaded once per process and reloaded only if the files change.
+    Returns a dict idx -> {"desc", "ww", "weights", "operator", "digest"}, where "weights" is the weight matrix
+    rounded as in the graphs, "operator" the same matrix in the format of the backend chosen by density
+    (see weight_operator) and "digest" its weights_digest. The arrays are read-only and shared by all the FCM objects."""
+    path = path if path is not None else model_path
+    if os.path.isfile(path):
+        return load_compiled_model(path)
+    files = glob.glob(f"{path}/*_desc.json") + glob.glob(f"{path}/*_wm.csv")
+    signature = files_signature(files)
+    compiled_file = f"{path}/{compiled_model_file}"
+    if compiled and os.path.isfile(compiled_file) and all(os.path.getmtime(compiled_file) >= mtime for _, mtime in signature):
+        return load_compiled_model(compiled_file)
+    key = os.path.abspath(path)
+    if key in _model_registry and _model_registry[key][0] == signature:
+        return _model_registry[key][1]
+
+    model = {}
+    for desc_file in glob.glob(f"{path}/*_desc.json"):
+        idx = int(os.path.basename(desc_file).split("_")[0])
+        with open(desc_file) as f:
+            desc = json.load(f)
+        ww = np.genfromtxt(f'{path}/{idx}_wm.csv', delimiter=',')
+        if ww.ndim != 2 or ww.shape[0] != ww.shape[1]:
+            raise ValueError(f"Weight matrix {path}/{idx}_wm.csv is not square: {ww.shape}")
+        if len(desc['nodes']) != ww.shape[0]:
+            raise ValueError(f"{path}/{idx}_desc.json describes {len(desc['nodes'])} nodes, {path}/{idx}_wm.csv has {ww.shape[0]}")
+        weights = np.round(ww, 5)
+        ww.setflags(write=False)
+        weights.setflags(write=False)
+        model[idx] = {"desc": desc, "ww": ww, "weights": weights, "operator": weight_operator(weights), "digest": weights_digest(weights)}
+
+    _model_registry[key] = (signature, model)
+    return model
+
+
+def compile_model(path=None, output=None, lambdas=None, company_type=None, cases=None):
+    """Pack the sub-FCMs in path (weight matrices and descriptions, model_path by default) in a single binary file,
+    by default the compiled model of the directory. lambdas (idx -> lambda) and the links of the case company_type
+    (in cases, cases_path by default) are stored too, if given. Returns the path of the compiled model."""
+    path = path if path is not None else model_path
+    output = output if output is not None else f"{path}/{compiled_model_file}"
+    model = load_model(path, compiled=False)
+    case = load_case(company_type, cases) if company_type is not None else None
+    header = {"maps": {}}
+    matrices = {}
+    for idx in sorted(model):
+        header["maps"][str(idx)] = {
+            "desc": model[idx]["desc"],
+            "lambda": lambdas.get(idx) if lambdas is not None else None,
+            "links": case[idx][:, 1].astype(int).tolist() if case is not None else None
+        }
+        matrices[f"ww/{idx}"] = model[idx]["ww"]
+        matrices[f"weights/{idx}"] = model[idx]["weights"]
+    FCM_binary.write_model(output, header, matrices)
+    return output
+
+
+def load_compiled_model(path):
+    """Load a model compiled by compile_model, same output of load_model plus the "lambda" and the "links" of each sub-FCM
+    (None if not compiled). The weight matrices are memory-mapped read-only."""
+    signature = files_signature([path])
+    key = os.path.abspath(path)
+    if key in _model_registry and _model_registry[key][0] == signature:
+        return _model_registry[key][1]
+
+    header, matrices = FCM_binary.read_model(path)
+    model = {}
+    for idx, info in header["maps"].items():
+        weights = matrices[f"weights/{idx}"]
+        model[int(idx)] = {"desc": info["desc"], "ww": matrices[f"ww/{idx}"], "weights": weights, "operator": weight_operator(weights),
+                           "digest": weights_digest(weights), "lambda": info["lambda"], "links": info["links"]}
+
+    _model_registry[key] = (signature, model)
+    return model
+
+
+def load_case(company_type, path=None):
+    """Load the activation levels of a case in path (cases_path by default), cached until the files change.
+    Returns a dict idx -> array of rows (linguistic term, link), to be copied before modifying it."""
+    path = path if path is not None else cases_path
+    case_path = f"{path}/{company_type}"
+    files = glob.glob(f"{case_path}/*_al.csv")
+    if len(files) == 0:
+        raise FileNotFoundError(f"No activation levels found in {case_path}")
+    signature = files_signature(files)
+    key = os.path.abspath(case_path)
+    if key in _cases_registry and _cases_registry[key][0] == signature:
+        return _cases_registry[key][1]
+
+    import pandas as pd
+    case = {}
+    for al_file in files:
+        idx = int(os.path.basename(al_file).split("_")[0])
+        case[idx] = pd.read_csv(al_file, header=None).values
+
+    _cases_registry[key] = (signature, case)
+    return case
+
+
 class FCM:
 
     def __init__(self, n_fcm, iterations, lambdas, company_type, flt, new_values=[], to_remove=[]):
@@ -19,32 +143,48 @@ class FCM:
         self.iterations = iterations
         self.al_flt = flt
         self.lambdas = lambdas
-        self.model : dict[nx.DiGraph] = self.build_model(company_type, new_values=new_values, to_remove=to_remove)
+        self.graphs = None
+        self.build_model(company_type, new_values=new_values, to_remove=to_remove)
+
+
+    @property
+    def model(self) -> "dict[nx.DiGraph]":
+        "Graphs of the sub-FCMs, built on first use: only the graph engine and the trajectories of the matrix engine need them"
+        if self.graphs is None:
+            self.graphs = {idx: FCM.fcm_from_matrix_to_graph(ww, self.activation_tables[idx], self.al_flt, self.new_values) for idx, ww in self.raw_weights.items()}
+        return self.graphs
 
 
     def build_model(self, company_type, new_values=[], to_remove=[]):
-        "Build the FCM model"
-        graph_list = {}
+        "Build the FCM model, the graphs are built by model"
+        self.new_values = new_values
+        self.raw_weights = {}
+        self.activation_tables = {}
         self.desc_graphs = {}
         self.weights_nodes = {}
+        self.weight_matrices = {}
+        self.weight_operators = {}
+        self.weight_digests = {}
+        self.initial_values = {}
         idx_new_values = 0
 
+        # weights and descriptions are loaded once per process, activation levels once per case
+        model = load_model()
+        case = load_case(company_type)
+
         self.idx_to_remove = []
-        desc_files = glob.glob(f"{model_path}/*.json")
-        for i in range(len(desc_files)):
-            file_to_open = desc_files[i]
-            data = json.load(open(file_to_open))
-            if data['main'] in to_remove:
-                self.idx_to_remove.append(i)
-                self.lambdas.pop(i)
+        for idx in range(1, self.n_fcm+1):
+            if model[idx]['desc']['main'] in to_remove:
+                self.idx_to_remove.append(idx)
+                self.lambdas.pop(idx)
 
         for idx in range(1, self.n_fcm+1):
             if idx in self.idx_to_remove:
                 continue
 
-            # get weights and activation levels from csv files 
-            ww = np.genfromtxt(f'{model_path}/{idx}_wm.csv', delimiter=',')
-            al = pd.read_csv(f'{cases_path}/{company_type}/{idx}_al.csv', header=None).values
+            # get weights and activation levels
+            ww = model[idx]['ww']
+            al = case[idx].copy()
 
             # if doing genetic algorithm, change the activation levels
             if len(new_values) > 0:
@@ -54,83 +194,167 @@ class FCM:
                     al[x][0] = new_values[idx_new_values]
                     idx_new_values+=1
 
-            # create graph from weights and activation levels
-            h = FCM.fcm_from_matrix_to_graph(ww, al, self.iterations+1, self.al_flt, new_values)
+            # weights and activation levels of the graph
+            self.raw_weights[idx] = ww
+            self.activation_tables[idx] = al
+
+            # dense weight matrix and initial activation vector used by the matrix engine
+            self.weight_matrices[idx] = model[idx]['weights']
+            self.weight_operators[idx] = model[idx]['operator']
+            self.weight_digests[idx] = model[idx]['digest']
+            self.initial_values[idx] = FCM.initial_activation_values(al, self.al_flt, new_values)
 
             # get description of the graph
-            desc = json.load(open(f'{model_path}/{idx}_desc.json'))
+            desc = model[idx]['desc']
             self.desc_graphs[idx] = desc
             self.weights_nodes[idx] = desc['weight']
 
-            graph_list[idx] = h
-
-        return graph_list
-
 
     @staticmethod
-    def fcm_from_matrix_to_graph(ww, al, iterations, flt : FLT_class.Fuzzy_Linguistic_Terms, new_values=[]):
+    def fcm_from_matrix_to_graph(ww, al, flt : FLT_class.Fuzzy_Linguistic_Terms, new_values=[]):
         "Create a graph based on a given matrix"
+        import networkx as nx
         G = nx.DiGraph(depth=0)
         n = ww.shape[0]
 
         # nodes
         # "value" is an array representing the activation level through the iterations
+        # (only the initial one here, the iterations are stored by run_fcm)
         # "link" is the index of the graph to which the node is linked to
         if len(new_values) == 0:    # if doing inference
             for k in range(n):
-                G.add_node(k, attr_dict = {"value":[0]*iterations, "link":al[k][1]})
+                G.add_node(k, attr_dict = {"value":[0], "link":al[k][1]})
                 l_al = al[k][0]
                 v_al = flt.get_value(l_al)
                 G.nodes[k]['attr_dict']['value'][0] = round(v_al, 5)
         else:   # if doing genetic algorithm
             for k in range(n):
-                G.add_node(k, attr_dict = {"value":[0]*iterations, "link":al[k][1]})
+                G.add_node(k, attr_dict = {"value":[0], "link":al[k][1]})
                 G.nodes[k]['attr_dict']['value'][0] = round(al[k][0], 5)
 
-        # edges
-        for i in range(n):
-            for j in range(n):
-                if (ww[i][j] != 0): G.add_edge(i, j, weight = round(ww[i][j], 5))
+        # edges, only the non-zero weights are visited
+        rows, cols = np.nonzero(ww)
+        G.add_weighted_edges_from(zip(rows.tolist(), cols.tolist(), np.round(ww[rows, cols], 5).tolist()))
 
         return G
 
 
-    def run_fcm(self, threshold=0.001):
+    @staticmethod
+    def initial_activation_values(al, flt : FLT_class.Fuzzy_Linguistic_Terms, new_values=[]):
+        "Create the initial activation vector of a sub-FCM, with the same rounding applied to the graph nodes"
+        if len(new_values) == 0:    # if doing inference
+            return np.array([round(flt.get_value(al[k][0]), 5) for k in range(len(al))], dtype=float)
+        else:   # if doing genetic algorithm
+            return np.array([round(al[k][0], 5) for k in range(len(al))], dtype=float)
+
+
+    def run_fcm(self, threshold=0.001, engine="graph", cache=None, trajectories=True, backend="auto", solver="papageorgiou"):
+        """Run the FCM algorithm, engine is 'graph' (networkx) or 'matrix' (numpy).
+        backend is the format of the weight matrices of the matrix engine, 'dense', 'sparse' or 'auto' (see use_sparse).
+        With the matrix engine, cache (an object with get/put, e.g. GA_class.LRUCache) stores the
+        trajectories of each sub-FCM, so only the sub-FCMs whose activation levels changed are run.
+        With trajectories=False (matrix engine only) only the final activation levels are kept,
+        in final_values, and the graphs are not updated.
+        solver is one of solvers: the fixed point ones (matrix engine and trajectories=False only) stop when all the nodes
+        change by less than threshold. The iterations and the residual of each sub-FCM are stored in solver_stats."""
         self.model_out = {}
-        "Run the FCM algorithm"
-        for key in self.model.keys():
+        self.final_values = {}
+        self.solver_stats = {}
+        if not trajectories and engine != "matrix":
+            raise ValueError("trajectories=False requires the matrix engine")
+        if solver not in solvers:
+            raise ValueError(f"Unknown solver: {solver}, expected one of {solvers}")
+        if solver != "papageorgiou" and trajectories:
+            raise ValueError(f"The {solver} solver requires the matrix engine and trajectories=False")
+        for key in self.initial_values.keys():
             lambda_value = self.lambdas[key]
-            G, t = FCM.papageorgiou_alg_graph(self.model[key], start_iter=1, end_iter=self.iterations+1, lambda_value=lambda_value, threshold=threshold)
-            for n in range(len(G.nodes)):
-                G.nodes[n]['attr_dict']['value'] = G.nodes[n]['attr_dict']['value'][:t]
+            if engine == "graph":
+                G = self.model[key]
+                G, t = FCM.papageorgiou_alg_graph(G, start_iter=1, end_iter=self.iterations+1, lambda_value=lambda_value, threshold=threshold)
+                for n in range(len(G.nodes)):
+                    G.nodes[n]['attr_dict']['value'] = G.nodes[n]['attr_dict']['value'][:t]
+                self.final_values[key] = np.array([G.nodes[n]['attr_dict']['value'][-1] for n in range(len(G.nodes))])
+                self.solver_stats[key] = {"iterations": t, "residual": None}
+            elif engine == "matrix":
+                ww = self.weight_matrices[key]
+                cache_key = (key, self.weight_digests[key], tuple(self.initial_values[key]), lambda_value, threshold, self.iterations, trajectories, solver)
+                entry = cache.get(cache_key) if cache is not None else None
+                if entry is None:
+                    operator = self.weight_operators[key] if backend == "auto" else weight_operator(ww, backend)
+                    residual = None
+                    if solver != "papageorgiou":
+                        values, t, residual = FCM.fixed_point(operator, self.initial_values[key], self.iterations, lambda_value, threshold, solver)
+                    elif trajectories:
+                        values, t = FCM.papageorgiou_alg_matrix(operator, self.initial_values[key], start_iter=1, end_iter=self.iterations+1, lambda_value=lambda_value, threshold=threshold)
+                        values = values[:t]
+                    else:
+                        values, t = FCM.papageorgiou_alg_final(operator, self.initial_values[key], start_iter=1, end_iter=self.iterations+1, lambda_value=lambda_value, threshold=threshold)
+                    entry = (values, t, residual)
+                    if cache is not None:
+                        values.setflags(write=False)
+                        cache.put(cache_key, entry)
+                values, t, residual = entry
+                self.solver_stats[key] = {"iterations": t, "residual": residual}
+                if not trajectories:
+                    self.final_values[key] = values
+                    continue
+                # store the trajectories in the graph so that the output is the same of the graph engine
+                G = self.model[key]
+                for n in range(len(G.nodes)):
+                    G.nodes[n]['attr_dict']['value'] = values[:, n].tolist()
+                self.final_values[key] = values[-1]
+            else:
+                raise ValueError(f"Unknown engine: {engine}")
             self.model_out[key] = G
-        max_iter = 0
-        for key in self.model_out.keys():
-            if len(self.model_out[key].nodes[0]['attr_dict']['value']) > max_iter:
-                max_iter = len(self.model_out[key].nodes[0]['attr_dict']['value'])
-        for key in self.model_out.keys():
-            if max_iter > len(self.model_out[key].nodes[0]['attr_dict']['value']):
-                for n in range(len(self.model_out[key].nodes)):
-                    idx_iter = len(self.model_out[key].nodes[n]['attr_dict']['value'])
-                    while idx_iter < max_iter:
-                        self.model_out[key].nodes[n]['attr_dict']['value'].append(self.model_out[key].nodes[n]['attr_dict']['value'][-1])
-                        idx_iter += 1
+
+        # the trajectories keep their own length, aligned_trajectories pads them to a common length
 
         weight_mean = 0
         n_elem = 0
-        for key in self.model_out.keys():
-            weight_mean += self.weights_nodes[key] * self.model_out[key].nodes[0]['attr_dict']['value'][-1]
+        for key in self.final_values.keys():
+            weight_mean += self.weights_nodes[key] * float(self.final_values[key][0])
             n_elem += 1
         self.main_final_al = weight_mean / n_elem
 
         return
 
 
+    def aligned_trajectories(self):
+        """Trajectories of the sub-FCMs (iterations x nodes), padded by repeating the last activation levels to the length of the longest one.
+        Used by print_weights_nodes and plot_al_values_graphs, they are kept only by run_fcm with trajectories=True"""
+        if len(getattr(self, "model_out", {})) == 0:
+            raise ValueError("No trajectories to show: run_fcm kept only the final activation levels (final_values), run it with trajectories=True")
+        trajectories = {key: np.array([G.nodes[n]['attr_dict']['value'] for n in range(len(G.nodes))]).T for key, G in self.model_out.items()}
+        max_iter = max(len(values) for values in trajectories.values())
+        return {key: np.pad(values, ((0, max_iter - len(values)), (0, 0)), mode='edge') for key, values in trajectories.items()}
+
+
+    def iter_fcm(self, threshold=0.001):
+        """Run the FCM algorithm (matrix engine) yielding, for each iteration, the activation levels of the nodes of each sub-FCM.
+        A sub-FCM that stopped repeats its last activation levels until all the sub-FCMs stop, as aligned_trajectories"""
+        runs = {key: FCM.papageorgiou_alg_iter(self.weight_operators[key], self.initial_values[key], start_iter=1, end_iter=self.iterations+1, lambda_value=self.lambdas[key], threshold=threshold) for key in self.initial_values.keys()}
+        current = {key: next(run) for key, run in runs.items()}
+        while True:
+            yield dict(current)
+            running = False
+            for key, run in runs.items():
+                values = next(run, None)
+                if values is not None:
+                    current[key] = values
+                    running = True
+            if not running:
+                return
+
+
     @staticmethod
     def papageorgiou_alg_graph(graph, start_iter, end_iter, lambda_value, threshold=0.001):
         "E.I. Papageorgiou, 'A new methodology for Decisions in Medical Informatics using fuzzy cognitive maps based on fuzzy rule-extraction techniques', Applied Soft Computing, vol. 11, Issue 1, p.p. 500-513, 2011."
         G = graph
 
+        # the activation levels of the iterations are allocated only when the graph engine runs
+        for node in G:
+            G.nodes[node]['attr_dict']['value'] += [0] * (end_iter - len(G.nodes[node]['attr_dict']['value']))
+
         for t in range(start_iter,end_iter):    #for each iteration
             for node in G:  #for each node in the graph
                 # contribution of the incoming edges
@@ -157,21 +381,24 @@ class FCM:
         return G, t
 
 
-    @staticmethod
-    def sigmoid(x, lambda_value):
-        "Sigmoid function"
-        return 1/(1+np.exp(-lambda_value*x))
+    # matrix engines of a sub-FCM, see FCM_engine
+    papageorgiou_alg_matrix = staticmethod(FCM_engine.papageorgiou_alg_matrix)
+    papageorgiou_alg_final = staticmethod(FCM_engine.papageorgiou_alg_final)
+    papageorgiou_alg_iter = staticmethod(FCM_engine.papageorgiou_alg_iter)
+    fixed_point = staticmethod(FCM_engine.fixed_point)
+    sigmoid = staticmethod(FCM_engine.sigmoid)
 
 
     def print_weights_nodes(self):
         "Print the weights of the nodes of the final graph"
+        trajectories = self.aligned_trajectories()
         for key in self.model_out.keys():
             # grafo i-esimo
             to_print = f"FCM {self.desc_graphs[key]['main']}\n"
             for n in range(len(self.model_out[key].nodes)):
                 # nodo n-esimo
                 to_print += f"\t{self.desc_graphs[key]['nodes'][str(n+1)]}:\t"
-                to_print += f"{self.model_out[key].nodes[n]['attr_dict']['value']}\n"
+                to_print += f"{trajectories[key][:, n].tolist()}\n"
                 pass
             print(to_print)
 
@@ -181,14 +408,9 @@ class FCM:
         initial_activation_levels = []
         final_activation_level = []
         name_fcm = []
-        for key in self.model_out.keys():
-            results_in = []
-            results_out = []
-            for j in range(len(self.model_out[key].nodes)):
-                results_in.append(self.model_out[key].nodes[j]['attr_dict']['value'][0])
-                results_out.append(self.model_out[key].nodes[j]['attr_dict']['value'][-1])
-            initial_activation_levels.append(results_in)
-            final_activation_level.append(results_out)
+        for key in self.final_values.keys():
+            initial_activation_levels.append(self.initial_values[key].tolist())
+            final_activation_level.append(self.final_values[key].tolist())
             name_fcm.append(self.desc_graphs[key]['main'])
         return initial_activation_levels, final_activation_level, name_fcm
 
@@ -213,17 +435,216 @@ class FCM:
             print(f"\t\t  {ling_final[i]}")
 
 
+def run_fcm_batch(activation_levels, n_fcm, iterations, lambdas, flt, threshold=0.001, to_remove=[], return_finals=False, backend="auto", solver="papageorgiou", return_stats=False):
+    """Run the FCM on N scenarios at once.
+    activation_levels is either a (N x genes) matrix of activation levels (the genes of the GA)
+    or a list of case folders in cases_path.
+    All the sub-FCMs are stacked in one block diagonal matrix (dense or CSR, see block_diagonal), so each iteration
+    is a single (N x nodes) update, and each scenario stops independently on the node 0 of each sub-FCM
+    (or on all the nodes with the fixed point solvers, see solve_fixed_point).
+    With return_stats a dict with the iterations and the residuals (sub-FCM -> N values, None with the papageorgiou solver)
+    is returned too."""
+    # sub-FCMs to consider
+    model = load_model()
+    keys = []
+    ww_list = []
+    weights_nodes = []
+    for idx in range(1, n_fcm+1):
+        desc = model[idx]['desc']
+        if desc['main'] in to_remove:
+            continue
+        keys.append(idx)
+        ww_list.append(model[idx]['weights'])
+        weights_nodes.append(desc['weight'])
+
+    sizes = [ww.shape[0] for ww in ww_list]
+    offsets = np.cumsum([0] + sizes[:-1])   # column of the node 0 of each sub-FCM
+    n_nodes = sum(sizes)
+
+    # block diagonal weight matrix, lambda and sub-FCM index of each column
+    ww_all = block_diagonal(ww_list, backend)
+    lambda_all = np.zeros(n_nodes)
+    group = np.zeros(n_nodes, dtype=int)
+    for k in range(len(keys)):
+        start, end = offsets[k], offsets[k] + sizes[k]
+        lambda_all[start:end] = lambdas[keys[k]]
+        group[start:end] = k
+
+    # initial activation levels
+    if len(activation_levels) > 0 and isinstance(activation_levels[0], str):   # if doing inference on cases
+        values = np.zeros((len(activation_levels), n_nodes))
+        for i, company_type in enumerate(activation_levels):
+            case = load_case(company_type)
+            for k in range(len(keys)):
+                al = case[keys[k]]
+                values[i, offsets[k]:offsets[k]+sizes[k]] = [round(flt.get_value(al[x][0]), 5) for x in range(sizes[k])]
+    else:   # if doing genetic algorithm, the main concept of each sub-FCM starts from 0
+        genes = np.round(np.asarray(activation_levels, dtype=float), 5)
+        genes = genes.reshape(len(genes), -1)
+        technologies = np.ones(n_nodes, dtype=bool)
+        technologies[offsets] = False
+        assert genes.shape[1] == technologies.sum()
+        values = np.zeros((len(genes), n_nodes))
+        values[:, technologies] = genes
+
+    values, t, residual = solve_blocks(ww_all, lambda_all, group, offsets, values, iterations, threshold, solver)
+    stats = {"iterations": None, "residual": None}
+    if solver != "papageorgiou":
+        stats = {"iterations": {keys[k]: t[:, k] for k in range(len(keys))}, "residual": {keys[k]: residual[:, k] for k in range(len(keys))}}
+
+    main_final_al = (values[:, offsets] * np.array(weights_nodes)).sum(axis=1) / len(keys)
+
+    output = (main_final_al,)
+    if return_finals:
+        output += ({keys[k]: values[:, offsets[k]:offsets[k]+sizes[k]] for k in range(len(keys))},)
+    if return_stats:
+        output += (stats,)
+    return output if len(output) > 1 else main_final_al
+
+
+def model_hierarchy(model, case=None):
+    """Hierarchy of the maps of a model, read from the link column of the activation levels of a case
+    (or from the links of a compiled model if case is None).
+    Returns the children of each map (node -> linked map), the output node of each map (the node named as
+    the main concept of the map) and the maps grouped by layer, from the bottom layer to the root one."""
+    children = {}
+    for idx in sorted(model):
+        links = case[idx][:, 1].astype(int) if case is not None else np.array(model[idx]['links'], dtype=int)
+        children[idx] = {node: int(links[node]) for node in range(len(links)) if links[node] != 0}
+        for child in children[idx].values():
+            if child not in model:
+                raise ValueError(f"Map {idx} links to map {child}, which is not in the model")
+            if 'layer' in model[idx]['desc'] and model[child]['desc'].get('layer', np.inf) <= model[idx]['desc']['layer']:
+                raise ValueError(f"Map {idx} (layer {model[idx]['desc']['layer']}) links to map {child}, which is not in a lower layer")
+
+    output_nodes = {}
+    for idx in sorted(model):
+        names = [model[idx]['desc']['nodes'][str(n+1)] for n in range(len(model[idx]['desc']['nodes']))]
+        if model[idx]['desc']['main'] not in names:
+            raise ValueError(f"Map {idx} has no node named as its main concept: {model[idx]['desc']['main']}")
+        output_nodes[idx] = names.index(model[idx]['desc']['main'])
+
+    # depth of each map from the bottom (leaf maps have depth 0), a map runs after all its children
+    depth = {}
+    def visit(idx, path):
+        if idx in path:
+            raise ValueError(f"Cycle in the links of the maps: {path + [idx]}")
+        if idx not in depth:
+            depth[idx] = max([visit(child, path + [idx]) + 1 for child in children[idx].values()], default=0)
+        return depth[idx]
+    for idx in sorted(model):
+        visit(idx, [])
+
+    layers = [sorted(idx for idx in depth if depth[idx] == d) for d in range(max(depth.values()) + 1)]
+    return children, output_nodes, layers
+
+
+def run_fcm_layered(activation_levels, iterations, lambdas, flt, threshold=0.001, to_remove=[], company_type=None, return_finals=False, backend="auto", solver="papageorgiou", return_stats=False):
+    """Run the whole hierarchy of maps of the model on N scenarios, from the bottom layer to the root map.
+    activation_levels is either a (N x genes) matrix of activation levels of the leaf maps (the genes of the GA,
+    in the order of run_fcm_batch) or a list of case folders in cases_path.
+    The links between the maps are read from the first case, or from company_type with the genes
+    (from the compiled model if company_type is None).
+    The maps of a layer are stacked in one block diagonal matrix (dense or CSR, see block_diagonal) and run together; the final activation level
+    of the output node of each map is the activation level of the linked node in the parent map, held during the run of the parent.
+    lambdas must contain a lambda for every map (the root map included), missing ones are taken from the compiled model.
+    solver and return_stats as in run_fcm_batch, with the iterations and the residuals of every map.
+    Returns the N final activation levels of the output node of the root map."""
+    model = load_model()
+    case_names = len(activation_levels) > 0 and isinstance(activation_levels[0], str)
+    links_case = activation_levels[0] if case_names else company_type
+    children, output_nodes, layers = model_hierarchy(model, load_case(links_case) if links_case is not None else None)
+    if len(layers[-1]) != 1:
+        raise ValueError(f"The model must have one root map, found {layers[-1]}")
+    lambdas = {idx: lambdas[idx] if idx in lambdas else model[idx].get('lambda') for idx in model}
+    missing = [idx for idx in model if lambdas[idx] is None]
+    if len(missing) > 0:
+        raise ValueError(f"Missing lambda for the maps {missing}")
+
+    # removed maps do not run and the linked nodes of their parents are disconnected
+    removed = [idx for idx in model if model[idx]['desc']['main'] in to_remove]
+    removed_nodes = {idx: [node for node, child in children[idx].items() if child in removed] for idx in model}
+
+    # initial activation levels of the nodes of each map
+    n_scenarios = len(activation_levels)
+    initial = {}
+    if case_names:   # if doing inference on cases
+        cases = [load_case(company_type) for company_type in activation_levels]
+        for idx in model:
+            initial[idx] = np.array([[round(flt.get_value(case[idx][x][0]), 5) for x in range(model[idx]['ww'].shape[0])] for case in cases])
+    else:   # if doing genetic algorithm, the genes are the nodes of the leaf maps but the output nodes, the other nodes start from 0
+        genes = np.round(np.asarray(activation_levels, dtype=float), 5)
+        genes = genes.reshape(len(genes), -1)
+        idx_genes = 0
+        for idx in sorted(model):
+            size = model[idx]['ww'].shape[0]
+            initial[idx] = np.zeros((n_scenarios, size))
+            if idx in layers[0] and idx not in removed:
+                technologies = [x for x in range(size) if x != output_nodes[idx]]
+                initial[idx][:, technologies] = genes[:, idx_genes:idx_genes+len(technologies)]
+                idx_genes += len(technologies)
+        assert idx_genes == genes.shape[1]
+
+    finals = {}
+    stats = {"iterations": None, "residual": None} if solver == "papageorgiou" else {"iterations": {}, "residual": {}}
+    for layer in layers:
+        keys = [idx for idx in layer if idx not in removed]
+        sizes = [model[idx]['ww'].shape[0] for idx in keys]
+        offsets = np.cumsum([0] + sizes[:-1]).astype(int)
+        n_nodes = sum(sizes)
+
+        # block diagonal weight matrix, lambda and map of each column, initial activation levels fed by the children
+        blocks = []
+        lambda_all = np.zeros(n_nodes)
+        group = np.zeros(n_nodes, dtype=int)
+        values = np.zeros((n_scenarios, n_nodes))
+        fixed = np.zeros(n_nodes, dtype=bool)
+        for k, idx in enumerate(keys):
+            start, end = offsets[k], offsets[k] + sizes[k]
+            ww = model[idx]['weights']
+            if len(removed_nodes[idx]) > 0:
+                ww = ww.copy()
+                ww[removed_nodes[idx], :] = 0
+                ww[:, removed_nodes[idx]] = 0
+            blocks.append(ww)
+            lambda_all[start:end] = lambdas[idx]
+            group[start:end] = k
+            values[:, start:end] = initial[idx]
+            for node, child in children[idx].items():
+                if child not in removed:
+                    values[:, start + node] = finals[child][:, output_nodes[child]]
+                    fixed[start + node] = True
+
+        ww_all = block_diagonal(blocks, backend)
+        values, t, residual = solve_blocks(ww_all, lambda_all, group, offsets + np.array([output_nodes[idx] for idx in keys], dtype=int), values, iterations, threshold, solver, fixed if fixed.any() else None)
+        for k, idx in enumerate(keys):
+            finals[idx] = values[:, offsets[k]:offsets[k]+sizes[k]]
+            if solver != "papageorgiou":
+                stats["iterations"][idx] = t[:, k]
+                stats["residual"][idx] = residual[:, k]
+
+    root = layers[-1][0]
+    main_final_al = finals[root][:, output_nodes[root]]
+    output = (main_final_al,)
+    if return_finals:
+        output += (finals,)
+    if return_stats:
+        output += (stats,)
+    return output if len(output) > 1 else main_final_al
+
+
 def plot_al_values_graphs(models, company, colors):
     "Plot the activation levels of the main node of multiple FCM"
+    import matplotlib.pyplot as plt
     if "_" in company:
         company = " ".join(company.split("_"))
     plt.figure()
     plt.grid()
     n_iter = 100
     idx_color = 0
-    for key in models.model_out.keys():
-        g = models.model_out[key]
-        y_val = g.nodes[0]['attr_dict']['value']
+    trajectories = models.aligned_trajectories()
+    for key in trajectories.keys():
+        y_val = trajectories[key][:, 0].tolist()
         if len(y_val) < n_iter:
             n_iter = len(y_val)
         x_val = list(range(len(y_val)))
@@ -239,9 +660,8 @@ def plot_al_values_graphs(models, company, colors):
     y_val_main = []
     while idx_iter < n_iter:
         y_val_mean = []
-        for key in models.model_out.keys():
-            g = models.model_out[key]
-            y_val_mean.append(g.nodes[0]['attr_dict']['value'][idx_iter])
+        for key in trajectories.keys():
+            y_val_mean.append(trajectories[key][idx_iter, 0])
         y_val_main.append(np.mean(y_val_mean))
         idx_iter += 1
     plt.figure()
@@ -256,6 +676,7 @@ def plot_al_values_graphs(models, company, colors):
 
 
 def plot_sigmoid(lambda_values):
+    import matplotlib.pyplot as plt
     plt.figure()
 
     c_i = 0
@@ -281,6 +702,8 @@ def plot_sigmoid(lambda_values):
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     config = json.load(open("config.json"))
     to_remove = config['to_remove']
     company = config['case']
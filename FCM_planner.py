@@ -0,0 +1,169 @@
+import numpy as np
+import itertools
+import json
+import sys
+import time
+import FLT_class
+from FCM_class import load_case, load_model, run_fcm_batch, solve_blocks
+from GA_class import Algorithm
+
+# Exact planner of the To Be: the minimal number of technologies to upgrade (raise to a higher linguistic term, as the
+# mutations of the GA) to reach a target maturity level.
+# The maturity level is the weighted mean of the outputs of the sub-FCMs, which run independently, so the search is
+# split in two: the best output of each sub-FCM with exactly c upgrades, enumerated by increasing c and only as far
+# as needed, and a knapsack on the number of upgrades of each sub-FCM. The first number of upgrades whose best
+# maturity level reaches the target is the minimal one.
+# The output of a sub-FCM is not monotone in the activation levels of the technologies (they are the initial
+# values of the iterations, and the FCM stops when the node 0 settles), so the best upgrades are not bounded by
+# the highest terms: all the combinations of the upgraded technologies and of their terms are run, in batches.
+
+
+class SubFCM(object):
+
+    chunk = 50000   # scenarios run at once
+
+    def __init__(self, idx, desc, ww, lambda_value, genes, levels, iterations, threshold, solver):
+        self.idx = idx
+        self.desc = desc
+        self.ww = ww
+        self.lambda_all = np.full(ww.shape[0], lambda_value)
+        self.genes = np.array(genes, dtype=float)  # activation levels of the technologies (nodes 1..n-1)
+        self.levels = levels
+        self.iterations = iterations
+        self.threshold = threshold
+        self.solver = solver
+        self.candidates = [x for x in range(len(genes)) if genes[x] < levels[-1]]  # technologies that can be upgraded
+        self.evaluations = 0
+        self.best = [(self.run(self.genes[None, :])[0], self.genes)]   # best output and activation levels, by number of upgrades
+
+    # final activation levels of the node 0 of the sub-FCM, for a (N x technologies) matrix of activation levels
+    def run(self, genes):
+        values = np.zeros((len(genes), self.ww.shape[0]))
+        values[:, 1:] = genes
+        values, _, _ = solve_blocks(self.ww, self.lambda_all, np.zeros(self.ww.shape[0], dtype=int), np.array([0]), values, self.iterations, self.threshold, self.solver)
+        self.evaluations += len(genes)
+        return values[:, 0]
+
+    # activation levels with exactly c technologies upgraded, in chunks
+    def upgrades(self, c):
+        rows = []
+        for technologies in itertools.combinations(self.candidates, c):
+            options = [[level for level in self.levels if level > self.genes[x]] for x in technologies]
+            for terms in itertools.product(*options):
+                row = self.genes.copy()
+                row[list(technologies)] = terms
+                rows.append(row)
+                if len(rows) == SubFCM.chunk:
+                    yield np.array(rows)
+                    rows = []
+        if len(rows) > 0:
+            yield np.array(rows)
+
+    # best output with exactly c upgrades (c <= number of candidates), the first of the ties
+    def best_output(self, c):
+        while len(self.best) <= c:
+            best = None
+            for genes in self.upgrades(len(self.best)):
+                values = self.run(genes)
+                i = int(np.argmax(values))
+                if best is None or values[i] > best[0]:
+                    best = (values[i], genes[i])
+            self.best.append(best)
+        return self.best[c]
+
+
+def load_sub_fcms(company_type, to_remove=[], flt=None, n_fcm=Algorithm.n_fcm, lambdas=Algorithm.lambdas, iterations=Algorithm.iterations,
+                  threshold=Algorithm.threshold, solver=Algorithm.solver):
+    "Sub-FCMs of the model (the ones not in to_remove) with the activation levels of company_type, as run_fcm_batch runs them"
+    flt = FLT_class.define_al_fuzzy() if flt is None else flt
+    levels = [flt.get_value(x) for x in flt.linguistic_terms.keys()][1:]    # linguistic values of the genes, NA excluded
+    model = load_model()
+    case = load_case(company_type)
+    sub_fcms = []
+    for idx in range(1, n_fcm+1):
+        desc = model[idx]['desc']
+        if desc['main'] in to_remove:
+            continue
+        al = case[idx]
+        genes = [round(flt.get_value(al[x][0]), 5) for x in range(1, len(al))]
+        sub_fcms.append(SubFCM(idx, desc, model[idx]['weights'], lambdas[idx], genes, levels, iterations, threshold, solver))
+    return sub_fcms
+
+
+def minimal_upgrades(target_val, company_type, to_remove=[], flt=None, tolerance=0.03, n_fcm=Algorithm.n_fcm, lambdas=Algorithm.lambdas,
+                     iterations=Algorithm.iterations, threshold=Algorithm.threshold, solver=Algorithm.solver):
+    """Minimal number of technologies of company_type to upgrade so that the maturity level reaches target_val
+    (it is above it or closer than tolerance, the stop of the GA), with the FCM run on the genes as in the GA.
+    Among the plans with the minimal number of upgrades the one with the highest maturity level is returned.
+    Returns a dict with the number of upgrades ('n_upgrades', None if the target cannot be reached), the upgrades
+    (fcm, node, technology, initial and final linguistic term), the genes, the maturity level ('result', the highest
+    reachable one if the target cannot be reached) and the number of runs of the sub-FCMs ('evaluations')."""
+    flt = FLT_class.define_al_fuzzy() if flt is None else flt
+    sub_fcms = load_sub_fcms(company_type, to_remove, flt, n_fcm, lambdas, iterations, threshold, solver)
+    weights = np.array([sub_fcm.desc['weight'] for sub_fcm in sub_fcms], dtype=float) / len(sub_fcms)
+    reached = lambda value: round(target_val - value, 3) < tolerance    # as the fitness of the GA
+
+    # best[s] is the best maturity level with s upgrades among the sub-FCMs seen, and the upgrades of each one
+    plan = None
+    best_plan = None
+    n_candidates = sum(len(sub_fcm.candidates) for sub_fcm in sub_fcms)
+    for m in range(n_candidates + 1):
+        best = {0: (0.0, ())}
+        for w, sub_fcm in zip(weights, sub_fcms):
+            new_best = {}
+            for s, (value, counts) in best.items():
+                for c in range(min(m - s, len(sub_fcm.candidates)) + 1):
+                    new_value = value + w * sub_fcm.best_output(c)[0]
+                    if s + c not in new_best or new_value > new_best[s + c][0]:
+                        new_best[s + c] = (new_value, counts + (c,))
+            best = new_best
+        if m not in best:
+            continue
+        if best_plan is None or best[m][0] > best_plan[0]:
+            best_plan = best[m]
+        if reached(best[m][0]):
+            plan = best[m][1]
+            break
+
+    counts = plan if plan is not None else best_plan[1]
+    genes = [sub_fcm.best_output(c)[1] for sub_fcm, c in zip(sub_fcms, counts)]
+    upgrades = []
+    for k, sub_fcm in enumerate(sub_fcms):
+        for x in np.flatnonzero(genes[k] != sub_fcm.genes):
+            upgrades.append({
+                "fcm": sub_fcm.idx,
+                "node": int(x) + 1,
+                "technology": sub_fcm.desc['nodes'][str(x + 2)],
+                "initial": flt.get_linguisitic_term(sub_fcm.genes[x]),
+                "final": flt.get_linguisitic_term(genes[k][x])
+            })
+    genes = np.concatenate(genes)
+    result = run_fcm_batch(genes[None, :], n_fcm, iterations, lambdas, flt, threshold, to_remove, solver=solver)[0]
+    return {
+        "n_upgrades": sum(plan) if plan is not None else None,
+        "upgrades": upgrades,
+        "genes": genes.tolist(),
+        "result": round(float(result), 6),
+        "evaluations": sum(sub_fcm.evaluations for sub_fcm in sub_fcms)
+    }
+
+
+if __name__ == "__main__":
+    config = json.load(open("config.json"))
+    to_remove = config['to_remove']
+    company = config['case'] if len(sys.argv) < 2 else sys.argv[1]
+    flt = FLT_class.define_al_fuzzy()
+    target_val = flt.get_value(config['target_val'])
+
+    start = time.perf_counter()
+    plan = minimal_upgrades(target_val, company, to_remove, flt)
+    elapsed = time.perf_counter() - start
+
+    print(f"Company Type: {company}, Target: {config['target_val']} ({target_val})")
+    if plan['n_upgrades'] is None:
+        print(f"The target cannot be reached, highest Smart Manufacturing maturity level: {plan['result']}")
+    else:
+        print(f"Minimal number of upgrades: {plan['n_upgrades']}, Smart Manufacturing maturity level: {plan['result']}")
+        for upgrade in plan['upgrades']:
+            print(f"\tFCM {upgrade['fcm']}, {upgrade['technology']}: {upgrade['initial']} -> {upgrade['final']}")
+    print(f"{plan['evaluations']} evaluations of the sub-FCMs in {elapsed:.2f} s")
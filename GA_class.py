@@ -1,31 +1,84 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import random
-from FCM_class import FCM
+import FCM_class
+from FCM_class import FCM, load_case, load_model, run_fcm_batch, solve_blocks
 import glob
 import FLT_class
-import pandas as pd
+import GA_operators
 import json
 import os
 import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from functools import partial
 
 model_path = "model"
 cases_path = "cases"
 
+
+# bounded least recently used cache, with hit/miss counters
+# the lock makes it safe to share between the threads grading a population
+class LRUCache(object):
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # returns the cached value, or None if the key is not in the cache
+    def get(self, key):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)   # remove the least recently used entry
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups > 0 else 0
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.data), "hit_rate": round(hit_rate, 3)}
+
+
+# fitness values shared across generations and runs, keyed by the gene vector
+fitness_cache = LRUCache(maxsize=100000)
+# trajectories of the single sub-FCMs, keyed by their slice of the gene vector
+# mutation and crossover leave most of the slices unchanged, so only the modified sub-FCMs are run
+sub_fcm_cache = LRUCache(maxsize=100000)
+# activation level linguistic terms, built once per process (the breakpoint index makes the constructor slow)
+al_flt = FLT_class.define_al_fuzzy()
+
 # class representing an individual in the population
 # in this case an individual is a FCM (activation levels of the nodes)
 class Individual(object):
 
     def __init__(self, genes=None, target_val=0.6, individual_id = None, company_type='low', to_remove=[]):
         if genes is None:
-            al_files = glob.glob(f'{cases_path}/{company_type}/*_al.csv')
-            n_fcm = len(al_files)
-            flt = FLT_class.define_al_fuzzy()
+            case = load_case(company_type)
+            n_fcm = len(case)
             self.genes = []
             for i in range(1, n_fcm):
-                al = pd.read_csv(f'{cases_path}/{company_type}/{i}_al.csv', header=None).values
+                al = case[i]
                 for x in range(1, len(al)):
-                    v_al = flt.get_value(al[x][0])
+                    v_al = al_flt.get_value(al[x][0])
                     self.genes.append(v_al)
             self.id = individual_id
         else:
@@ -36,24 +89,113 @@ class Individual(object):
         self.company_type = company_type
         self.to_remove = to_remove
 
+    # key of the individual in the fitness cache, with the parameters of the FCM (Algorithm.signature)
+    # the genes only take the discrete activation levels, the rounding removes floating point noise
+    def cache_key(self, generation=None):
+        genes = None if generation == 0 else tuple(round(g, 5) for g in self.genes)
+        return (genes, self.company_type, self.target_val, tuple(self.to_remove), Algorithm.signature())
+
     # Returns fitness of individual
     # Fitness is the difference between target value and the calculated value
-    def fitness(self, run=False, generation=None):
+    # Individuals with the same genes are not run again if their fitness is in the cache
+    def fitness(self, run=False, generation=None, cache=fitness_cache):
         if run==True:
+            key = self.cache_key(generation)
+            cached_fitness = cache.get(key) if cache is not None else None
+            if cached_fitness is not None:
+                self.fitness_val = cached_fitness
+                return self.fitness_val
             if generation == 0:
                 self.algorithm = Algorithm(company_type=self.company_type, to_remove=self.to_remove)  # run the FCM algorithm
             else:
                 self.algorithm = Algorithm(genes=self.genes, company_type=self.company_type, to_remove=self.to_remove)  # run the FCM algorithm
-            computed_objective = self.algorithm.result
-            self.fitness_val = round(abs(self.target_val - computed_objective), 3)
+            self.set_objective(self.algorithm.result, generation, cache)
+        return self.fitness_val
+
+    # set the fitness from the value computed by the FCM algorithm (e.g. in a worker process)
+    def set_objective(self, computed_objective, generation=None, cache=fitness_cache):
+        self.fitness_val = round(abs(self.target_val - computed_objective), 3)
+        if cache is not None:
+            cache.put(self.cache_key(generation), self.fitness_val)
         return self.fitness_val
 
 
+# initializer of the grading workers, the model is loaded once per worker
+def init_grading_worker():
+    load_model()
+
+
+# run the FCM algorithm on a gene vector (None for the activation levels of the case) and return its result
+def evaluate_genes(genes, company_type='low', to_remove=[]):
+    if genes is None:
+        return Algorithm(company_type=company_type, to_remove=to_remove).result
+    return Algorithm(genes=list(genes), company_type=company_type, to_remove=to_remove).result
+
+
+# create the executor used to grade the populations
+# kind is 'serial', 'thread' or 'process', n_workers=None uses the number of cores
+def make_executor(kind='serial', n_workers=None):
+    if kind == 'serial':
+        return None
+    if kind == 'thread':
+        return ThreadPoolExecutor(max_workers=n_workers)
+    if kind == 'process':
+        return ProcessPoolExecutor(max_workers=n_workers, initializer=init_grading_worker)
+    raise ValueError(f"Unknown executor: {kind}")
+
+
+# write the checkpoint of a run in a compressed .npz file (no pickle), replaced atomically
+# it stores the genes and the fitness of the population, the fitness histories, the generation to run next
+# (the last graded one if the run is finished) and the state of the random generators
+# meta describes the run, a checkpoint is resumed only by a run with the same meta
+def save_checkpoint(path, pop, generation, finished, meta):
+    genes, fitness = pop.checkpoint_state()
+    _, random_state, gauss_next = random.getstate()
+    _, np_keys, np_pos, np_has_gauss, np_cached_gaussian = np.random.get_state()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f,
+            meta=np.array(json.dumps(meta, sort_keys=True)),
+            generation=np.array(generation),
+            finished=np.array(finished),
+            done=np.array(pop.done),
+            genes=genes,
+            fitness=fitness,
+            fitness_history=np.array(pop.fitness_history, dtype=float),
+            ind_fitness_history=np.array(pop.ind_fitness_history, dtype=float),
+            random_state=np.array(random_state, dtype=np.uint32),
+            random_gauss=np.array([] if gauss_next is None else [gauss_next]),
+            np_keys=np_keys,
+            np_state=np.array([np_pos, np_has_gauss]),
+            np_gauss=np.array(np_cached_gaussian))
+    os.replace(tmp_path, path)
+
+
+# read a checkpoint written by save_checkpoint
+def load_checkpoint(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+
+# restore the population and the random generators from a checkpoint read by load_checkpoint
+def restore_checkpoint(state, pop):
+    pop.restore_state(state['genes'], state['fitness'])
+    pop.fitness_history = state['fitness_history'].tolist()
+    pop.ind_fitness_history = list(state['ind_fitness_history'])
+    pop.done = bool(state['done'])
+    gauss_next = float(state['random_gauss'][0]) if len(state['random_gauss']) > 0 else None
+    random.setstate((3, tuple(int(x) for x in state['random_state']), gauss_next))
+    np_pos, np_has_gauss = state['np_state']
+    np.random.set_state(('MT19937', state['np_keys'], int(np_pos), int(np_has_gauss), float(state['np_gauss'])))
+
+
 # class representing the population
 # in this case the population is an evolving set of individuals (FCMs with different activation levels)
 class Population(object):
 
-    def __init__(self, pop_size=10, crossover_prob=0.7, retain=5, target_val=0.6, individual_size = 30, company_type='low', to_remove=[], flt:FLT_class.Fuzzy_Linguistic_Terms=None):
+    # executor is 'serial', 'thread', 'process' or an already created concurrent.futures.Executor
+    def __init__(self, pop_size=10, crossover_prob=0.7, retain=5, target_val=0.6, individual_size = 30, company_type='low', to_remove=[], flt:FLT_class.Fuzzy_Linguistic_Terms=None,
+                 executor='serial', n_workers=None, chunksize=1):
         self.pop_size = pop_size
         self.individuals_size = individual_size
         self.crossover_prob = crossover_prob
@@ -64,8 +206,13 @@ class Population(object):
         self.parents = []
         self.elite = []
         self.to_remove = to_remove
+        self.company_type = company_type
         self.done = False
         self.values = [flt.get_value(x) for x in flt.linguistic_terms.keys()][1:]
+        self.executor = executor
+        self.n_workers = n_workers
+        self.chunksize = chunksize
+        self.pool = executor if isinstance(executor, Executor) else None
 
         # Create individuals
         self.individuals : list[Individual] = []
@@ -73,11 +220,69 @@ class Population(object):
             self.individuals.append(Individual(genes=None, target_val=self.target_val, individual_id=x, company_type=company_type, to_remove=to_remove))
 
 
+    # the pool is not pickled with the population
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pool'] = None
+        if isinstance(self.executor, Executor):
+            state['executor'] = 'serial'
+        return state
+
+
+    # shut down the pool created by the population
+    def close(self):
+        if self.pool is not None and not isinstance(self.executor, Executor):
+            self.pool.shutdown()
+        self.pool = None
+
+
+    # genes and fitness of the individuals, as arrays for the checkpoints
+    def checkpoint_state(self):
+        return np.array([x.genes for x in self.individuals], dtype=float), np.array([x.fitness_val for x in self.individuals], dtype=float)
+
+
+    # replace the individuals with the ones of a checkpoint
+    def restore_state(self, genes, fitness):
+        self.individuals = []
+        for x in range(len(genes)):
+            individual = Individual(genes=genes[x].tolist(), target_val=self.target_val, company_type=self.company_type, to_remove=self.to_remove)
+            individual.fitness_val = fitness[x]
+            self.individuals.append(individual)
+
+
+    # run the FCM algorithm of the individuals not in the fitness cache in the pool
+    # only the gene vectors are sent to the workers, results are collected in the order of the individuals
+    def evaluate_parallel(self, generation=None):
+        if self.pool is None:
+            self.pool = make_executor(self.executor, self.n_workers)
+
+        pending = {}    # individuals to run, grouped by cache key
+        for x in self.individuals:
+            key = x.cache_key(generation)
+            cached_fitness = fitness_cache.get(key)
+            if cached_fitness is not None:
+                x.fitness_val = cached_fitness
+            else:
+                pending.setdefault(key, []).append(x)
+
+        genes = [None if generation == 0 else xs[0].genes[:] for xs in pending.values()]
+        evaluate = partial(evaluate_genes, company_type=self.company_type, to_remove=self.to_remove)
+        results = self.pool.map(evaluate, genes, chunksize=self.chunksize)
+        for xs, computed_objective in zip(pending.values(), results):
+            for x in xs:
+                x.set_objective(computed_objective, generation)
+
+
     # Grade the generation by getting the average fitness of its individuals
     def grade(self, generation=None):
+        if self.executor != 'serial':
+            self.evaluate_parallel(generation)   # run the FCM algorithm in the pool
         fitness_sum = 0
         for x in self.individuals:
-            fitness_sum += x.fitness(run=True, generation=generation)  # run the FCM algorithm
+            if self.executor == 'serial':
+                fitness_sum += x.fitness(run=True, generation=generation)  # run the FCM algorithm
+            else:
+                fitness_sum += x.fitness()
         fitness_sum = round(fitness_sum, 3)
 
         pop_fitness = round(fitness_sum / self.pop_size, 3)
@@ -117,10 +322,10 @@ class Population(object):
                 if self.crossover_prob > np.random.rand():
                     idx_crossover = np.random.randint(0, len(father.genes))
                     child_genes = father.genes[:idx_crossover] + mother.genes[idx_crossover:]
-                    child = Individual(genes=child_genes, target_val=self.target_val, to_remove=self.to_remove)
+                    child = Individual(genes=child_genes, target_val=self.target_val, company_type=self.company_type, to_remove=self.to_remove)
                     children.append(child)
                     child_genes = mother.genes[:idx_crossover] + father.genes[idx_crossover:]
-                    child = Individual(genes=child_genes, target_val=self.target_val, to_remove=self.to_remove)
+                    child = Individual(genes=child_genes, target_val=self.target_val, company_type=self.company_type, to_remove=self.to_remove)
                     children.append(child)
             children = children[:target_children_size]
             self.individuals = children
@@ -162,27 +367,327 @@ class Population(object):
         self.elite = []
 
 
+# surrogate of the FCM for ArrayPopulation, built on the sub-FCMs run so far: the sub-FCMs are independent, so the output
+# of a sub-FCM (the final activation level of node 0) is looked up by its genes if they were already run, and the
+# children, which share most of the sub-FCMs of their parents, are run exactly running only the new sub-FCMs.
+# The outputs not yet run are predicted by the mean of the outputs of the n_neighbors nearest genes (L1 distance)
+# weighted by 1 / (1 + distance), n_neighbors=0 runs them all (exact fitness). The error is measured on the predictions
+# of the individuals run exactly afterwards: the promising ones and a random fraction audit of the others
+class Surrogate(object):
+
+    def __init__(self, to_remove=[], n_neighbors=3, min_errors=20, quantile=0.95, audit=0.05, seed=0):
+        model = load_model()
+        self.keys = [idx for idx in range(1, Algorithm.n_fcm+1) if model[idx]['desc']['main'] not in to_remove]
+        self.ww = [model[idx]['weights'] for idx in self.keys]
+        offsets = np.cumsum([0] + [ww.shape[0] - 1 for ww in self.ww])
+        self.slices = [slice(offsets[k], offsets[k+1]) for k in range(len(self.keys))]     # genes of each sub-FCM
+        self.weights = np.array([model[idx]['desc']['weight'] for idx in self.keys])
+        self.outputs = [{} for _ in self.keys]  # genes of the sub-FCM -> output
+        self.samples = [None] * len(self.keys)  # outputs as (genes, outputs) arrays for the nearest neighbours
+        self.n_neighbors = n_neighbors
+        self.min_errors = min_errors
+        self.quantile = quantile
+        self.audit = audit
+        self.rng = np.random.default_rng(seed)  # the random generators of the GA are not used
+        self.errors = []
+        self.n_exact = 0
+        self.n_approximated = 0
+        self.n_runs = 0     # sub-FCMs run
+
+    # outputs of the sub-FCMs of a (N x genes) matrix, NaN if not run yet
+    def lookup(self, genes):
+        outputs = np.full((len(genes), len(self.keys)), np.nan)
+        for k in range(len(self.keys)):
+            for i, row in enumerate(np.round(genes[:, self.slices[k]], 5)):
+                outputs[i, k] = self.outputs[k].get(tuple(row.tolist()), np.nan)
+        return outputs
+
+    # results of the sub-FCM outputs, as run_fcm_batch
+    def results(self, outputs):
+        return (outputs * self.weights).sum(axis=1) / len(self.keys)
+
+    # exact results of a (N x genes) matrix, only the sub-FCMs not run yet are run (once for each distinct genes)
+    def run(self, genes):
+        outputs = self.lookup(genes)
+        for k, idx in enumerate(self.keys):
+            missing = np.isnan(outputs[:, k])
+            if not missing.any():
+                continue
+            sub_genes, inverse = np.unique(np.round(genes[missing, self.slices[k]], 5), axis=0, return_inverse=True)
+            n = self.ww[k].shape[0]
+            values = np.zeros((len(sub_genes), n))
+            values[:, 1:] = sub_genes
+            values, _, _ = solve_blocks(self.ww[k], np.full(n, Algorithm.lambdas[idx]), np.zeros(n, dtype=int), np.array([0]), values, Algorithm.iterations, Algorithm.threshold, Algorithm.solver)
+            for row, output in zip(sub_genes, values[:, 0]):
+                self.outputs[k][tuple(row.tolist())] = output
+            self.samples[k] = None
+            self.n_runs += len(sub_genes)
+            outputs[missing, k] = values[inverse.reshape(-1), 0]
+        return self.results(outputs)
+
+    # predicted results of a (N x genes) matrix and which ones are exact (all the sub-FCMs already run),
+    # NaN if a sub-FCM cannot be predicted
+    def predict(self, genes):
+        outputs = self.lookup(genes)
+        exact = ~np.isnan(outputs).any(axis=1)
+        for k in range(len(self.keys)):
+            missing = np.isnan(outputs[:, k])
+            if not missing.any() or self.n_neighbors == 0 or len(self.outputs[k]) == 0:
+                continue
+            if self.samples[k] is None:
+                self.samples[k] = (np.array(list(self.outputs[k].keys())), np.array(list(self.outputs[k].values())))
+            sample_genes, sample_outputs = self.samples[k]
+            distance = np.abs(np.round(genes[missing, self.slices[k]], 5)[:, None, :] - sample_genes[None, :, :]).sum(axis=2)
+            n = min(self.n_neighbors, len(sample_outputs))
+            nearest = np.argpartition(distance, n - 1, axis=1)[:, :n]
+            weight = 1 / (1 + np.take_along_axis(distance, nearest, axis=1))
+            outputs[missing, k] = (weight * sample_outputs[nearest]).sum(axis=1) / weight.sum(axis=1)
+        return self.results(outputs), exact
+
+    # error allowed on the predicted fitness: the quantile of the errors measured, infinite until min_errors are measured
+    def margin(self):
+        if len(self.errors) < self.min_errors:
+            return np.inf
+        return float(np.quantile(self.errors, self.quantile))
+
+    # individuals graded exactly and approximated, fraction of the exact evaluations avoided by the predictions (the
+    # saving of the surrogate, 0 with n_neighbors=0), fraction of the sub-FCM outputs of the exact evaluations reused from
+    # the ones already run (the saving of the memoization) and errors of the predictions
+    def stats(self):
+        errors = np.array(self.errors)
+        n_graded = self.n_exact + self.n_approximated
+        n_outputs = self.n_exact * len(self.keys)
+        return {
+            "exact": self.n_exact,
+            "approximated": self.n_approximated,
+            "sub_fcm_runs": self.n_runs,
+            "avoided": round(self.n_approximated / n_graded, 4) if n_graded > 0 else 0.0,
+            "reused": round(1 - self.n_runs / n_outputs, 4) if n_outputs > 0 else 0.0,
+            "errors": len(errors),
+            "mean_error": round(float(errors.mean()), 5) if len(errors) > 0 else None,
+            "max_error": round(float(errors.max()), 5) if len(errors) > 0 else None
+        }
+
+
+# population stored as a (pop_size x genes) array, evolved with array operations
+# the operators have the same semantics of Population and the whole generation is graded with one batched FCM run
+class ArrayPopulation(object):
+
+    # surrogate is a Surrogate pre-screening the individuals to run exactly, None to run them all
+    def __init__(self, pop_size=10, crossover_prob=0.7, retain=5, target_val=0.6, individual_size = 30, company_type='low', to_remove=[], flt:FLT_class.Fuzzy_Linguistic_Terms=None,
+                 surrogate=None):
+        self.pop_size = pop_size
+        self.individuals_size = individual_size
+        self.crossover_prob = crossover_prob
+        self.retain = retain
+        self.target_val = target_val
+        self.fitness_history = []
+        self.ind_fitness_history = []
+        self.to_remove = to_remove
+        self.company_type = company_type
+        self.done = False
+        self.values = np.array(sorted([flt.get_value(x) for x in flt.linguistic_terms.keys()][1:]))
+        self.surrogate = surrogate
+
+        # all the individuals start from the activation levels of the case
+        initial_genes = Individual(genes=None, company_type=company_type, to_remove=to_remove).genes
+        self.genes = np.tile(np.array(initial_genes, dtype=float), (pop_size, 1))
+        self.fitness_vals = np.zeros(pop_size)
+        self.parents = self.genes[:0]
+        self.elite = self.genes[:0]
+
+    # individuals of the population, sorted as the rows of the array (for compatibility with Population)
+    @property
+    def individuals(self):
+        individuals = []
+        for x in range(len(self.genes)):
+            individual = Individual(genes=self.genes[x].tolist(), target_val=self.target_val, individual_id=x, company_type=self.company_type, to_remove=self.to_remove)
+            individual.fitness_val = self.fitness_vals[x]
+            individuals.append(individual)
+        return individuals
+
+    # the pool is not used, kept for compatibility with Population
+    def close(self):
+        pass
+
+    # genes and fitness of the individuals, as arrays for the checkpoints
+    def checkpoint_state(self):
+        return self.genes, self.fitness_vals
+
+    # replace the individuals with the ones of a checkpoint
+    def restore_state(self, genes, fitness):
+        self.genes = np.array(genes, dtype=float)
+        self.fitness_vals = np.array(fitness, dtype=float)
+
+    # Grade the generation with one batched FCM run on the distinct gene vectors not in the fitness cache
+    def grade(self, generation=None):
+        unique_genes, inverse = np.unique(np.round(self.genes, 5), axis=0, return_inverse=True)
+        unique_fitness = np.zeros(len(unique_genes))
+        signature = Algorithm.signature()
+        keys = [(tuple(row.tolist()), self.company_type, self.target_val, tuple(self.to_remove), signature) for row in unique_genes]
+        to_run = []
+        for i in range(len(keys)):
+            cached_fitness = fitness_cache.get(keys[i])
+            if cached_fitness is not None:
+                unique_fitness[i] = cached_fitness
+            else:
+                to_run.append(i)
+        if len(to_run) > 0 and self.surrogate is not None:
+            self.grade_surrogate(unique_genes, unique_fitness, np.bincount(inverse.reshape(-1), minlength=len(unique_genes)), keys, to_run)
+        elif len(to_run) > 0:
+            results = Algorithm.run_batch(unique_genes[to_run], self.to_remove)
+            for i, computed_objective in zip(to_run, results):
+                unique_fitness[i] = round(abs(self.target_val - computed_objective), 3)
+                fitness_cache.put(keys[i], unique_fitness[i])
+        self.fitness_vals = unique_fitness[inverse.reshape(-1)]
+
+        fitness_sum = round(float(sum(self.fitness_vals.tolist())), 3)     # same summation order of Population
+        pop_fitness = round(fitness_sum / self.pop_size, 3)
+        self.fitness_history.append(pop_fitness)
+
+        # sort individuals by fitness (lower fitness it better in this case), the sort is stable as sorted()
+        order = np.argsort(self.fitness_vals, kind='stable')
+        self.genes = self.genes[order]
+        self.fitness_vals = self.fitness_vals[order]
+        self.ind_fitness_history.append(self.fitness_vals[0])
+
+        # set done to True if the target value is reached or if the fitness is too low
+        if pop_fitness < 0.03 or self.fitness_vals[0]==0 or self.fitness_vals[0] < 0.03:
+            self.done = True
+
+        if generation is not None:
+            print(f"Generation: {generation}, Population fitness: {pop_fitness}, Fitness sum: {fitness_sum}, Best individual fitness: {self.fitness_vals[0]}")
+
+    # fitness of the distinct gene vectors to_run (counts individuals each) with the surrogate: the ones with all the
+    # sub-FCMs already run are exact, the ones that may become parents, with a predicted fitness within the margin of the
+    # surrogate from the fitness of the last parent, are run exactly (again if the exact fitness changes the last parent),
+    # the others keep the predicted fitness. Only the exact fitness is cached
+    def grade_surrogate(self, unique_genes, unique_fitness, counts, keys, to_run):
+        surrogate = self.surrogate
+        n_parents = max(1, int((self.retain/100) * self.pop_size))
+        to_run = np.array(to_run)
+        predicted, exact = surrogate.predict(unique_genes[to_run])
+        unique_fitness[to_run] = np.round(np.abs(self.target_val - predicted), 3)
+        run = ~exact & (np.isnan(predicted) | (surrogate.rng.random(len(to_run)) < surrogate.audit))
+        while True:
+            # fitness of the last parent, the predicted fitness counts
+            last_parent = np.sort(np.repeat(unique_fitness, counts))[n_parents - 1]
+            run |= ~exact & (unique_fitness[to_run] <= last_parent + surrogate.margin() + 0.001)
+            if not run.any():
+                break
+            results = surrogate.run(unique_genes[to_run[run]])
+            surrogate.errors.extend(np.abs(results - predicted[run])[~np.isnan(predicted[run])].tolist())
+            for i, computed_objective in zip(to_run[run], results):
+                unique_fitness[i] = round(abs(self.target_val - computed_objective), 3)
+            exact |= run
+            run[:] = False
+        for i in to_run[exact]:
+            fitness_cache.put(keys[i], unique_fitness[i])
+        surrogate.n_exact += int(exact.sum())
+        surrogate.n_approximated += int((~exact).sum())
+
+    # select the fittest individuals (elitist selection) to be the parents of next generation
+    def Select(self):
+        self.parents = GA_operators.select(self.genes, self.retain)
+        self.elite = self.parents.copy()
+
+    # one-point crossover of random pairs of distinct parents, the elite is kept
+    def Crossover(self):
+        self.genes = GA_operators.crossover(self.genes, self.parents, self.elite, self.pop_size, self.crossover_prob)
+
+    # raises one of the lowest genes of each individual to a random higher value
+    def Mutation(self):
+        GA_operators.mutation(self.genes, self.values)
+
+    # evolves the current population to the next generation
+    def evolve(self):
+        self.Select()
+        self.Crossover()
+        self.Mutation()
+        self.parents = self.genes[:0]
+        self.elite = self.genes[:0]
+
+
+# evolve an island of the island model from generation start to end (excluded), in a worker process
+# the state of the random generators of the island travels with it, so the islands do not depend on the worker running them
+def run_island(pop, start, end, rng_state):
+    random.setstate(rng_state[0])
+    np.random.set_state(rng_state[1])
+    x = start
+    for x in range(start, end):
+        if x > 0:
+            pop.evolve()
+        pop.grade(generation=x)
+        if pop.done:
+            break
+    pop.close()
+    return pop, x, (random.getstate(), np.random.get_state())
+
+
+# islands sending their migrants to each island: 'ring' (from the previous island), 'full' (from all the other islands)
+# or a dict island -> list of source islands
+def migration_sources(n_islands, topology='ring'):
+    if isinstance(topology, dict):
+        return {i: list(topology.get(i, [])) for i in range(n_islands)}
+    if topology == 'ring':
+        return {i: [(i - 1) % n_islands] if n_islands > 1 else [] for i in range(n_islands)}
+    if topology == 'full':
+        return {i: [j for j in range(n_islands) if j != i] for i in range(n_islands)}
+    raise ValueError(f"Unknown topology: {topology}")
+
+
+# copy the n_migrants best individuals of the sources of each island in place of its worst individuals
+# the populations are graded (sorted by fitness), they are sorted again after the migration
+def migrate(pops, sources, n_migrants):
+    states = [pop.checkpoint_state() for pop in pops]     # all the migrants leave before any arrives
+    for i, pop in enumerate(pops):
+        if len(sources[i]) == 0:
+            continue
+        genes, fitness = np.array(states[i][0]), np.array(states[i][1])
+        migrants_genes = np.concatenate([states[j][0][:n_migrants] for j in sources[i]])
+        migrants_fitness = np.concatenate([states[j][1][:n_migrants] for j in sources[i]])
+        n = min(len(migrants_genes), len(genes) // 2)
+        genes[len(genes) - n:] = migrants_genes[:n]
+        fitness[len(genes) - n:] = migrants_fitness[:n]
+        order = np.argsort(fitness, kind='stable')
+        pop.restore_state(genes[order], fitness[order])
+
+
 # class representing the FCM algorithm
 class Algorithm(object):
 
-    def __init__(self, genes=[], company_type='low', to_remove=[]):
-        flt = FLT_class.define_al_fuzzy()
+    n_fcm = 5   # number of sub-fcms
+    lambdas = {
+        1: 0.83,
+        2: 0.85,
+        3: 0.81,
+        4: 0.91,
+        5: 0.735
+    }
+    iterations = 100  # number of iterations
+    threshold = 0.001    # threshold
+    solver = "papageorgiou"  # solver of the FCM, one of FCM_class.solvers
 
-        n_fcm = 5   # number of sub-fcms
-        lambdas = {
-            1: 0.83,
-            2: 0.85,
-            3: 0.81,
-            4: 0.91,
-            5: 0.735
-        }
-        iterations = 100  # number of iterations
-        threshold = 0.001    # threshold
+    # flt defaults to the linguistic terms built once by the module (al_flt)
+    def __init__(self, genes=[], company_type='low', to_remove=[], cache=sub_fcm_cache, flt=None):
+        flt = al_flt if flt is None else flt
 
-        fcm_obj = FCM(n_fcm, iterations, lambdas, company_type, flt, genes, to_remove)
-        fcm_obj.run_fcm(threshold)
+        fcm_obj = FCM(Algorithm.n_fcm, Algorithm.iterations, dict(Algorithm.lambdas), company_type, flt, genes, to_remove)
+        fcm_obj.run_fcm(Algorithm.threshold, engine="matrix", cache=cache, trajectories=False, solver=Algorithm.solver)
         self.result = fcm_obj.main_final_al
 
+    # parameters of the FCM run by the algorithm, part of the keys of the fitness cache:
+    # a fitness computed with another solver, other lambdas or another model is never reused
+    @staticmethod
+    def signature():
+        return (Algorithm.solver, tuple(sorted(Algorithm.lambdas.items())), Algorithm.iterations, Algorithm.threshold, os.path.abspath(FCM_class.model_path))
+
+    # run the FCM algorithm on a (N x genes) matrix at once, returns the N results
+    @staticmethod
+    def run_batch(genes, to_remove=[], flt=None):
+        flt = al_flt if flt is None else flt
+        return run_fcm_batch(genes, Algorithm.n_fcm, Algorithm.iterations, Algorithm.lambdas, flt, Algorithm.threshold, to_remove, solver=Algorithm.solver)
+
 
 class ALGA_class():
 
@@ -201,33 +706,208 @@ class ALGA_class():
         return individual_size
 
 
+    # paths of the checkpoints of the runs with the given names in checkpoint_dir (None without checkpoints)
+    def checkpoint_paths(checkpoint_dir, names):
+        if checkpoint_dir is None:
+            return [None] * len(names)
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        return [os.path.join(checkpoint_dir, f"{name}.npz") for name in names]
+
+
     # execute the what-if analysis of the FCM
-    def what_if(n_runs, pop_size, generation, retain, target_val, company_type, to_remove, flt):
-        # FCM parameters
-        individual_size = ALGA_class.compute_individual_size(to_remove)
+    # seeds of n_runs independent runs, derived from a master seed
+    def run_seeds(n_runs, seed):
+        return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n_runs)]
+
 
-        results = []
-        results_pop = []
-        results_gen = []
-        for k in range(n_runs):
-            pop = Population(pop_size=pop_size, retain=retain, target_val=target_val, individual_size=individual_size, company_type=company_type, to_remove=to_remove, flt = flt)
+    # execute a single run of the what-if analysis
+    # seed initializes the random generators of the run, executor is the one grading the population
+    # population is 'list' (Population) or 'array' (ArrayPopulation, graded with batched FCM runs)
+    # checkpoint is the path of the checkpoint of the run, written every checkpoint_every generations and at the end:
+    # with resume the run continues from it (if it exists) with the same results of a run never interrupted
+    # surrogate (True or a dict of options of Surrogate) pre-screens the individuals of an ArrayPopulation with a Surrogate
+    def run_simulation(k, pop_size, generation, retain, target_val, company_type, to_remove, flt, individual_size, seed=None, executor='serial', chunksize=1, population='list',
+                       checkpoint=None, checkpoint_every=10, resume=False, surrogate=None):
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+        if surrogate and population != 'array':
+            raise ValueError("The surrogate pre-screens only the array population")
+        if surrogate and checkpoint is not None:
+            raise ValueError("The surrogate is not stored in the checkpoints")
 
-            for x in range(generation):
+        if population == 'array':
+            surrogate = Surrogate(to_remove, **(surrogate if isinstance(surrogate, dict) else {})) if surrogate else None
+            pop = ArrayPopulation(pop_size=pop_size, retain=retain, target_val=target_val, individual_size=individual_size, company_type=company_type, to_remove=to_remove, flt = flt,
+                                  surrogate=surrogate)
+        elif population == 'list':
+            pop = Population(pop_size=pop_size, retain=retain, target_val=target_val, individual_size=individual_size, company_type=company_type, to_remove=to_remove, flt = flt,
+                             executor=executor, chunksize=chunksize)
+        else:
+            raise ValueError(f"Unknown population: {population}")
+
+        meta = {"population": population, "pop_size": pop_size, "retain": retain, "target_val": target_val, "company_type": company_type,
+                "to_remove": list(to_remove), "individual_size": individual_size}
+        start = 0
+        finished = False
+        if resume and checkpoint is not None and os.path.exists(checkpoint):
+            state = load_checkpoint(checkpoint)
+            if json.loads(str(state['meta'])) != json.loads(json.dumps(meta)):
+                raise ValueError(f"The checkpoint {checkpoint} belongs to another run: {state['meta']}")
+            restore_checkpoint(state, pop)
+            start = int(state['generation'])
+            finished = bool(state['finished'])
+            if not finished and start >= generation:
+                raise ValueError(f"The checkpoint {checkpoint} is at generation {start}, the run has {generation} generations")
+            print(f"\tSimulation: {k} Resumed at generation: {start}")
+
+        x = start
+        if not finished:
+            for x in range(start, generation):
                 pop.grade(generation = x)
                 if pop.done or x == generation - 1: # if target value is reached or if we reached the last generation
                     print(f"\tSimulation: {k} Finished at generation: {x}, Population fitness: {pop.fitness_history[-1]}, Individual fitness: {pop.ind_fitness_history[-1]}")
+                    print(f"\tFitness cache: {fitness_cache.stats()}, Sub-FCM cache: {sub_fcm_cache.stats()}")
+                    if population == 'array' and pop.surrogate is not None:
+                        print(f"\tSurrogate: {pop.surrogate.stats()}")
                     break
                 pop.evolve()
+                if checkpoint is not None and (x + 1) % checkpoint_every == 0:
+                    save_checkpoint(checkpoint, pop, x + 1, False, meta)
+            if checkpoint is not None:
+                save_checkpoint(checkpoint, pop, x, True, meta)
+        pop.close()
+
+        finalAL = pop.individuals[0].genes[:]   # copy of the activation levels of the best individual
+        return k, finalAL, pop, x
+
+
+    # execute the what-if analysis of the FCM, yielding (run, activation levels of the best individual, population, generation) as the runs finish
+    # run_workers > 1 distributes the runs across processes, seed makes the runs reproducible (each run gets its own seed)
+    # executor, n_workers and chunksize define how each generation is graded (see Population), runs in worker processes are graded serially
+    # with checkpoint_dir each run k is checkpointed in checkpoint_dir/run_k.npz, see run_simulation
+    def what_if_iter(n_runs, pop_size, generation, retain, target_val, company_type, to_remove, flt, executor='serial', n_workers=None, chunksize=1, run_workers=1, seed=None, population='list',
+                     checkpoint_dir=None, checkpoint_every=10, resume=False, surrogate=None):
+        # FCM parameters
+        individual_size = ALGA_class.compute_individual_size(to_remove)
+        seeds = ALGA_class.run_seeds(n_runs, seed) if seed is not None else [None] * n_runs
+        args = (pop_size, generation, retain, target_val, company_type, to_remove, flt, individual_size)
+        checkpoints = ALGA_class.checkpoint_paths(checkpoint_dir, [f"run_{k}" for k in range(n_runs)])
+        options = dict(population=population, checkpoint_every=checkpoint_every, resume=resume, surrogate=surrogate)
+
+        if run_workers == 1:
+            # the same pool grades all the runs
+            pool = make_executor(executor, n_workers) if isinstance(executor, str) else executor
+            try:
+                for k in range(n_runs):
+                    yield ALGA_class.run_simulation(k, *args, seed=seeds[k], executor=pool if pool is not None else 'serial', chunksize=chunksize, checkpoint=checkpoints[k], **options)
+            finally:
+                if isinstance(executor, str) and pool is not None:
+                    pool.shutdown()
+        else:
+            with ProcessPoolExecutor(max_workers=run_workers, initializer=init_grading_worker) as pool:
+                futures = [pool.submit(ALGA_class.run_simulation, k, *args, seed=seeds[k], checkpoint=checkpoints[k], **options) for k in range(n_runs)]
+                for future in as_completed(futures):
+                    yield future.result()
 
-            finalAL = pop.individuals[0].genes[:]   # copy of the activation levels of the best individual
-            results.append(finalAL) # add the activation levels of the best individual to the results array
-            results_pop.append(pop) # add the population to the results array
-            results_gen.append(x)   # add the generation to the results array
+
+    # execute the what-if analysis of the FCM
+    def what_if(n_runs, pop_size, generation, retain, target_val, company_type, to_remove, flt, executor='serial', n_workers=None, chunksize=1, run_workers=1, seed=None, population='list',
+                checkpoint_dir=None, checkpoint_every=10, resume=False, surrogate=None):
+        results = [None] * n_runs
+        results_pop = [None] * n_runs
+        results_gen = [None] * n_runs
+        for k, finalAL, pop, x in ALGA_class.what_if_iter(n_runs, pop_size, generation, retain, target_val, company_type, to_remove, flt,
+                                                         executor=executor, n_workers=n_workers, chunksize=chunksize, run_workers=run_workers, seed=seed, population=population,
+                                                         checkpoint_dir=checkpoint_dir, checkpoint_every=checkpoint_every, resume=resume, surrogate=surrogate):
+            results[k] = finalAL    # add the activation levels of the best individual to the results array
+            results_pop[k] = pop    # add the population to the results array
+            results_gen[k] = x      # add the generation to the results array
 
         return results, results_pop, results_gen
 
 
+    # execute the what-if analysis for several company types, distributing all the runs across run_workers processes
+    # returns {company_type: (results, results_pop, results_gen, time_taken)}, time_taken is measured until the last run of the company type finishes
+    # with a seed, the runs of the i-th company type are the same of what_if with seed=run_seeds(len(company_types), seed)[i]
+    # with checkpoint_dir the run k of each company type is checkpointed in checkpoint_dir/{company_type}_run_k.npz, see run_simulation
+    def what_if_types(company_types, n_runs, pop_size, generation, retain, target_val, to_remove, flt, run_workers=None, seed=None, population='list',
+                      checkpoint_dir=None, checkpoint_every=10, resume=False, surrogate=None):
+        type_seeds = ALGA_class.run_seeds(len(company_types), seed) if seed is not None else [None] * len(company_types)
+        individual_size = ALGA_class.compute_individual_size(to_remove)
+        options = dict(population=population, checkpoint_every=checkpoint_every, resume=resume, surrogate=surrogate)
+
+        results_tot = {company_type: ([None] * n_runs, [None] * n_runs, [None] * n_runs, 0) for company_type in company_types}
+        time_start = time.time()
+        with ProcessPoolExecutor(max_workers=run_workers, initializer=init_grading_worker) as pool:
+            futures = {}
+            for i, company_type in enumerate(company_types):
+                seeds = ALGA_class.run_seeds(n_runs, type_seeds[i]) if seed is not None else [None] * n_runs
+                checkpoints = ALGA_class.checkpoint_paths(checkpoint_dir, [f"{company_type}_run_{k}" for k in range(n_runs)])
+                for k in range(n_runs):
+                    future = pool.submit(ALGA_class.run_simulation, k, pop_size, generation, retain, target_val, company_type, to_remove, flt, individual_size, seed=seeds[k],
+                                         checkpoint=checkpoints[k], **options)
+                    futures[future] = company_type
+            for future in as_completed(futures):
+                company_type = futures[future]
+                k, finalAL, pop, x = future.result()
+                results, results_pop, results_gen, _ = results_tot[company_type]
+                results[k] = finalAL
+                results_pop[k] = pop
+                results_gen[k] = x
+                results_tot[company_type] = (results, results_pop, results_gen, time.time() - time_start)
+
+        return results_tot
+
+
+    # execute the what-if analysis with the island model: n_islands populations evolve in run_workers processes
+    # (None uses the number of cores) and every migration_interval generations the n_migrants best individuals of each island
+    # replace the worst ones of the islands it is linked to by topology (see migration_sources)
+    # the analysis stops when an island reaches the target or at the last generation, returns the best genes,
+    # the population and the last generation of each island, as what_if (e.g. for visualize)
+    def what_if_islands(n_islands, pop_size, generation, retain, target_val, company_type, to_remove, flt, migration_interval=10, n_migrants=2, topology='ring',
+                        run_workers=None, seed=None, population='array'):
+        individual_size = ALGA_class.compute_individual_size(to_remove)
+        sources = migration_sources(n_islands, topology)
+        pops = []
+        for k in range(n_islands):
+            if population == 'array':
+                pops.append(ArrayPopulation(pop_size=pop_size, retain=retain, target_val=target_val, individual_size=individual_size, company_type=company_type, to_remove=to_remove, flt=flt))
+            elif population == 'list':
+                pops.append(Population(pop_size=pop_size, retain=retain, target_val=target_val, individual_size=individual_size, company_type=company_type, to_remove=to_remove, flt=flt))
+            else:
+                raise ValueError(f"Unknown population: {population}")
+        rng_states = [(random.Random(s).getstate(), np.random.RandomState(s).get_state()) for s in ALGA_class.run_seeds(n_islands, seed)]
+        results_gen = [0] * n_islands
+
+        pool = ProcessPoolExecutor(max_workers=run_workers, initializer=init_grading_worker) if run_workers != 1 else None
+        try:
+            start = 0
+            while start < generation:
+                end = min(start + migration_interval, generation)
+                if pool is None:
+                    epochs = [run_island(pops[k], start, end, rng_states[k]) for k in range(n_islands)]
+                else:
+                    futures = [pool.submit(run_island, pops[k], start, end, rng_states[k]) for k in range(n_islands)]
+                    epochs = [future.result() for future in futures]
+                for k, (pop, x, rng_state) in enumerate(epochs):
+                    pops[k], results_gen[k], rng_states[k] = pop, x, rng_state
+                if any(pop.done for pop in pops) or end == generation:
+                    break
+                migrate(pops, sources, n_migrants)
+                start = end
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        for k in range(n_islands):
+            print(f"\tIsland: {k} Finished at generation: {results_gen[k]}, Population fitness: {pops[k].fitness_history[-1]}, Individual fitness: {pops[k].ind_fitness_history[-1]}")
+        results = [pop.individuals[0].genes[:] for pop in pops]    # activation levels of the best individual of each island
+        return results, pops, results_gen
+
+
     def visualize(results, results_pop, company_type):
+        import matplotlib.pyplot as plt
         plt.figure(f"fitness_{company_type}")
         max_generations = max([len(pop.fitness_history) for pop in results_pop])
         for i in range(len(results)):
@@ -274,7 +954,7 @@ class ALGA_class():
         for idx in range(1, n_fcm+1):
             if idx in idx_to_remove:
                 continue
-            al = pd.read_csv(f'{cases_path}/{company}/{idx}_al.csv', header=None).values
+            al = load_case(company)[idx]
             for x in range(1, len(al)):
                 initial_values.append(flt.get_value(al[x][0]))
 
@@ -296,6 +976,8 @@ class ALGA_class():
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     config = json.load(open("config.json"))
     to_remove = config['to_remove']
     company = config['case']
@@ -315,11 +997,16 @@ if __name__ == "__main__":
     generation = 250    # number of generations
     crossover_prob = 0.7    # probability of crossover
     retain = 15  # percentage of fittest individuals to be kept as parents for next generation (elitist selection)
+    run_workers = 1 # number of processes running the simulations in parallel
+    seed = None     # master seed of the simulations
+    checkpoint_dir = None   # directory of the checkpoints of the runs (e.g. "ga_checkpoints"), None to disable them
+    resume = False  # continue the runs from their checkpoints
     flt = FLT_class.define_al_fuzzy()
 
     target_val = flt.get_value(target_val)
 
-    results, results_pop, results_gen = ALGA_class.what_if(n_runs, pop_size, generation, retain, target_val, company, idx_to_remove, flt)
+    results, results_pop, results_gen = ALGA_class.what_if(n_runs, pop_size, generation, retain, target_val, company, idx_to_remove, flt, run_workers=run_workers, seed=seed,
+                                                           checkpoint_dir=checkpoint_dir, resume=resume)
 
     # from the results_pop array, get the best individual
     best_individuals = []
@@ -338,15 +1025,14 @@ if __name__ == "__main__":
                 data = json.load(json_file)
                 print(f"FCM {data['main']}")
                 n_nodes = len(data['nodes'])
-                with open(f'{cases_path}/{company}/{j}_al.csv') as al_file:
-                    al = pd.read_csv(al_file, header=None).values
-                    for k in range(1, n_nodes):
-                        initial_al = al[k][0]
-                        final_al = flt.get_linguisitic_term(best_best_individual.genes[idx_best_individual])
-                        idx_best_individual += 1
-                        print(f"\tNode {data['nodes'][str(k+1)]}")
-                        print(f"\t\tInitial AL:\t{initial_al}")
-                        print(f"\t\tFinal AL: \t{final_al}")
+                al = load_case(company)[j]
+                for k in range(1, n_nodes):
+                    initial_al = al[k][0]
+                    final_al = flt.get_linguisitic_term(best_best_individual.genes[idx_best_individual])
+                    idx_best_individual += 1
+                    print(f"\tNode {data['nodes'][str(k+1)]}")
+                    print(f"\t\tInitial AL:\t{initial_al}")
+                    print(f"\t\tFinal AL: \t{final_al}")
 
     # visualize the results
     ALGA_class.visualize(results, results_pop, company)
@@ -0,0 +1,63 @@
+import numpy as np
+
+# genetic operators on a (individuals x genes) array of activation levels, shared by GA_class.ArrayPopulation and the
+# backend of the tool (my-tool/backend/GA_operators.py is a copy of this file, as FCM_engine.py)
+# rng is a numpy Generator (np.random.default_rng) or the np.random module itself, whose global state is the one
+# of the seeded runs, the checkpoints and the islands of GA_class
+
+
+def randint(rng, low, high, size):
+    "Random integers in [low, high) from rng, a Generator or the np.random module"
+    return rng.integers(low, high, size) if hasattr(rng, "integers") else rng.randint(low, high, size)
+
+
+def select(genes, retain):
+    "Elitist selection: the first retain % of the individuals (sorted by fitness) are the parents of the next generation"
+    return genes[:int((retain/100) * len(genes))]
+
+
+def crossover(genes, parents, elite, pop_size, crossover_prob, rng=np.random):
+    """One-point crossover of random pairs of distinct parents, the elite is kept.
+    Returns the pop_size individuals of the next generation (genes if there are no parents)"""
+    n_parents = len(parents)
+    if n_parents == 0:
+        return genes
+    size = genes.shape[1]
+    n_children = pop_size - len(elite)
+    children = [elite]
+    while n_children > 0:
+        # draw enough pairs, only a fraction crossover_prob of them generates children
+        n_pairs = int(np.ceil(n_children / 2 / crossover_prob)) + 1
+        father = randint(rng, 0, n_parents, n_pairs)
+        mother = (father + randint(rng, 1, n_parents, n_pairs)) % n_parents if n_parents > 1 else father
+        accepted = crossover_prob > rng.random(n_pairs)
+        father, mother = father[accepted], mother[accepted]
+        idx_crossover = randint(rng, 0, size, len(father))
+        # mask[k, i] is True if gene i of the first child k comes from the father
+        mask = np.arange(size) < idx_crossover[:, None]
+        child_1 = np.where(mask, parents[father], parents[mother])
+        child_2 = np.where(mask, parents[mother], parents[father])
+        # children are interleaved as in GA_class.Population.Crossover
+        pairs = np.stack([child_1, child_2], axis=1).reshape(-1, size)
+        children.append(pairs[:n_children])
+        n_children -= len(pairs[:n_children])
+    return np.concatenate(children)[:pop_size]
+
+
+def mutation(genes, values, rng=np.random):
+    """Raise one of the lowest genes of each individual (in place) to a random higher value:
+    first a random value in 0.1...0.9 as in GA_class.Population.Mutation, otherwise a random linguistic value
+    (values, sorted) greater than the current one, at most the highest"""
+    n, size = genes.shape
+    rows = np.arange(n)
+    # random position among the ones with the lowest value
+    lowest = genes == genes.min(axis=1, keepdims=True)
+    mutate_index = np.argmax(lowest * rng.random((n, size)), axis=1)
+    old_value = genes[rows, mutate_index]
+    new_value = randint(rng, 1, 10, n) / 10
+    retry = new_value <= old_value
+    n_greater = (values[None, :] > old_value[:, None]).sum(axis=1)
+    choice = len(values) - n_greater + np.floor(rng.random(n) * n_greater).astype(int)
+    choice = np.minimum(choice, len(values) - 1)
+    genes[rows, mutate_index] = np.where(retry, values[choice], new_value)
+    return genes
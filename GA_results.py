@@ -0,0 +1,106 @@
+import numpy as np
+import json
+import os
+import pickle
+
+# columnar store of the results of the GA, a single compressed .npz file with one array for each company type and column:
+#   best_genes          (runs x genes) activation levels of the best individual of each run
+#   best_fitness        (runs) fitness of the best individual
+#   generations         (runs) last generation of each run
+#   fitness_history     (runs x generations) fitness of the population, padded with NaN
+#   ind_fitness_history (runs x generations) fitness of the best individual, padded with NaN
+#   population_genes    (runs x individuals x genes) final population of each run
+#   population_fitness  (runs x individuals)
+#   time_taken          () seconds taken by the runs of the company type
+# and a JSON header 'meta' (company types, parameters of the populations and any metadata of the caller).
+# The arrays are read only when accessed, so a column of a company type is loaded without the others.
+columns = ("best_genes", "best_fitness", "generations", "fitness_history", "ind_fitness_history", "population_genes", "population_fitness", "time_taken")
+
+
+def pad_histories(histories):
+    "(runs x longest history) array of the histories, padded with NaN"
+    table = np.full((len(histories), max(len(history) for history in histories)), np.nan)
+    for i, history in enumerate(histories):
+        table[i, :len(history)] = history
+    return table
+
+
+def results_table(results, results_pop, results_gen, time_taken=0):
+    """Columns of the runs of a company type, from the output of ALGA_class.what_if (the best genes, the populations,
+    Population or ArrayPopulation, and the last generations)"""
+    return {
+        "best_genes": np.array(results, dtype=float),
+        "best_fitness": np.array([pop.individuals[0].fitness_val for pop in results_pop], dtype=float),
+        "generations": np.array(results_gen, dtype=int),
+        "fitness_history": pad_histories([pop.fitness_history for pop in results_pop]),
+        "ind_fitness_history": pad_histories([pop.ind_fitness_history for pop in results_pop]),
+        "population_genes": np.array([[x.genes for x in pop.individuals] for pop in results_pop], dtype=float),
+        "population_fitness": np.array([[x.fitness_val for x in pop.individuals] for pop in results_pop], dtype=float),
+        "time_taken": np.array(time_taken, dtype=float)
+    }
+
+
+def save_results(path, results_tot, meta={}):
+    """Write the results of the GA, {company_type: (results, results_pop, results_gen, time_taken)} as stored by eval_ga.py
+    and returned by ALGA_class.what_if_types, in the columnar store path (.npz).
+    meta is a JSON serializable dict stored in the header (e.g. the seed)."""
+    arrays = {}
+    header = {"company_types": list(results_tot), "populations": {}}
+    header.update(meta)
+    for company_type, (results, results_pop, results_gen, time_taken) in results_tot.items():
+        for column, array in results_table(results, results_pop, results_gen, time_taken).items():
+            arrays[f"{company_type}/{column}"] = array
+        pop = results_pop[0]
+        header["populations"][company_type] = {"n_runs": len(results), "pop_size": pop.pop_size, "retain": pop.retain,
+                                               "crossover_prob": pop.crossover_prob, "target_val": float(pop.target_val)}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, meta=np.array(json.dumps(header)), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_meta(path):
+    "Header of a columnar store written by save_results"
+    with np.load(path, allow_pickle=False) as data:
+        return json.loads(str(data["meta"]))
+
+
+def load_results(path, company_types=None, columns=columns):
+    """Read the given columns of the given company types (all if None) from a columnar store written by save_results,
+    returns {company_type: {column: array}}; the other arrays of the file are not read"""
+    with np.load(path, allow_pickle=False) as data:
+        company_types = json.loads(str(data["meta"]))["company_types"] if company_types is None else company_types
+        return {company_type: {column: data[f"{company_type}/{column}"] for column in columns} for company_type in company_types}
+
+
+# classes of the GA in the pickles of eval_ga.py, they only need their attributes to be converted
+class PickledObject(object):
+    pass
+
+
+class ResultsUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if name in ("Population", "ArrayPopulation", "Individual", "Algorithm"):
+            return PickledObject
+        return super().find_class(module, name)
+
+
+def convert_pickle(pickle_path, path, meta={}):
+    "Convert the results pickled by eval_ga.py (e.g. ga_results/results.pkl) in a columnar store, the GA classes are not needed"
+    with open(pickle_path, "rb") as f:
+        results_tot = ResultsUnpickler(f).load()
+    save_results(path, results_tot, meta)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert the results pickled by eval_ga.py in the columnar store of GA_results.py")
+    parser.add_argument("pickle", help="pickle of the results, e.g. evaluation/ga_results/results.pkl")
+    parser.add_argument("output", help="columnar store to write, e.g. evaluation/ga_results/results.npz")
+    args = parser.parse_args()
+
+    convert_pickle(args.pickle, args.output, {"source": os.path.basename(args.pickle)})
+    meta = load_meta(args.output)
+    for company_type in meta["company_types"]:
+        print(f"{company_type}: {meta['populations'][company_type]['n_runs']} runs")
+    print(f"Written {args.output} ({os.path.getsize(args.output)} bytes)")
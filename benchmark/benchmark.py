@@ -0,0 +1,208 @@
+import sys
+import os
+import json
+import time
+import platform
+import argparse
+import copy
+import io
+import contextlib
+
+# run from the root of the repository: python benchmark/benchmark.py
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+tool_path = os.path.join(root_path, "my-tool", "backend")
+sys.path.insert(0, root_path)
+sys.path.append(tool_path)
+os.chdir(root_path)
+
+import numpy as np
+import FLT_class
+import FCM_class
+from FCM_class import FCM
+import GA_class
+from GA_class import ALGA_class
+
+baseline_path = os.path.join(root_path, "benchmark", "baseline.json")
+lambdas = {
+    1: 0.83,
+    2: 0.85,
+    3: 0.81,
+    4: 0.91,
+    5: 0.735
+}
+root_lambda = 0.8   # lambda of the root map, run only by run_fcm_layered
+n_fcm = 5   # number of sub-fcms
+iterations = 100  # number of iterations
+threshold = 0.001
+
+
+def measure(function, repeat):
+    "Median wall time of function in milliseconds, after one warm-up call"
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000
+
+
+def result(value, unit, better="lower"):
+    return {"value": round(value, 6), "unit": unit, "better": better}
+
+
+def bench_fcm_cases(flt, repeat):
+    "Latency of building and running the FCM of each case"
+    results = {}
+    for company in sorted(os.listdir(FCM_class.cases_path)):
+        for engine in ("graph", "matrix"):
+            def run():
+                fcm_obj = FCM(n_fcm, iterations, dict(lambdas), company, flt)
+                fcm_obj.run_fcm(threshold, engine=engine)
+            results[f"fcm_case/{company}/{engine}"] = result(measure(run, repeat), "ms")
+    return results
+
+
+def bench_fcm_layered(flt, repeat):
+    "Latency of the whole hierarchy of maps (run_fcm_layered) on all the cases at once"
+    cases = sorted(os.listdir(FCM_class.cases_path))
+    layered_lambdas = {0: root_lambda, **lambdas}
+    finals = FCM_class.run_fcm_layered(cases, iterations, layered_lambdas, flt, threshold)
+    # the linked nodes of the root map hold the outputs of the IT systems, so the cases must not collapse on the same level
+    case_study, naive = finals[cases.index("case_study")], finals[cases.index("naive")]
+    assert case_study - naive > 0.2, f"run_fcm_layered gives {case_study} for case_study and {naive} for naive"
+    run = lambda: FCM_class.run_fcm_layered(cases, iterations, layered_lambdas, flt, threshold)
+    return {f"fcm_layered/{len(cases)}_cases": result(measure(run, repeat), "ms")}
+
+
+def bench_ga(flt, generations):
+    "Generations per second of ALGA_class.what_if, for each population type"
+    results = {}
+    for population in ("list", "array"):
+        # the caches are shared across runs: the second run would read the fitness and the sub-FCMs of the first one
+        GA_class.fitness_cache.clear()
+        GA_class.sub_fcm_cache.clear()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, _, gens = ALGA_class.what_if(1, 50, generations, 15, 0.95, "case_study", [], flt, seed=0, population=population)
+        elapsed = time.perf_counter() - start
+        results[f"ga/{population}/generations_per_sec"] = result((gens[0] + 1) / elapsed, "gen/s", "higher")
+    return results
+
+
+def bench_flt(flt, n_values):
+    "Throughput of the classification of activation levels in linguistic terms"
+    values = np.random.default_rng(0).random(n_values)
+    values_list = values.tolist()
+    scalar = measure(lambda: [flt.get_linguisitic_term(v) for v in values_list], 3)
+    vectorized = measure(lambda: flt.get_linguistic_terms(values), 3)
+    return {
+        "flt/get_linguisitic_term/values_per_sec": result(n_values / scalar * 1000, "values/s", "higher"),
+        "flt/get_linguistic_terms/values_per_sec": result(n_values / vectorized * 1000, "values/s", "higher")
+    }
+
+
+def bench_server(repeat):
+    "Latency of the /inference and /inference/batch endpoints through the Flask test client"
+    import server
+    client = server.app.test_client()
+    structure = json.load(open(os.path.join(root_path, "my-tool", "single_file.json")))
+    rng = np.random.default_rng(0)
+    terms = ["VL", "L", "M", "H", "VH"]
+    activation_levels = []
+    for _ in range(100):
+        activation_level = []
+        for node in structure["nodes"]:
+            node_al = {"id": node["id"], "label": ", ".join(node["meanings"]), "weight": str(rng.choice(terms)) if node["role"] == "final" else "NA"}
+            if node["role"] == "intermediate":
+                node_al["enabled"] = True
+            activation_level.append(node_al)
+        activation_levels.append(activation_level)
+
+    def inference():
+        response = client.post("/inference", json={"structure": copy.deepcopy(structure), "activation_level": activation_levels[0]})
+        assert response.status_code == 200
+    def inference_batch():
+        response = client.post("/inference/batch", json={"structure": structure, "activation_levels": activation_levels})
+        assert response.status_code == 200
+    with contextlib.redirect_stdout(io.StringIO()):
+        return {
+            "server/inference": result(measure(inference, repeat), "ms"),
+            "server/inference_batch_100": result(measure(inference_batch, max(1, repeat // 10)), "ms")
+        }
+
+
+def bench_synthetic(sizes, repeat):
+    "Latency of one sub-FCM with n nodes and random weights (10% density), with the matrix engine"
+    results = {}
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        ww = np.round(rng.random((n, n)) * (rng.random((n, n)) < 0.1) / (0.1 * n), 5)
+        initial_values = rng.choice([0.1, 0.3, 0.5, 0.7, 0.9], n)
+        run = lambda: FCM.papageorgiou_alg_matrix(ww, initial_values, start_iter=1, end_iter=iterations+1, lambda_value=0.8, threshold=threshold)
+        results[f"synthetic/{n}_nodes"] = result(measure(run, repeat), "ms")
+    return results
+
+
+def run_benchmarks(quick=False):
+    flt = FLT_class.define_al_fuzzy()
+    repeat = 5 if quick else 20
+    results = {}
+    results.update(bench_fcm_cases(flt, repeat))
+    results.update(bench_fcm_layered(flt, repeat))
+    results.update(bench_ga(flt, 10 if quick else 30))
+    results.update(bench_flt(flt, 20000 if quick else 100000))
+    results.update(bench_server(repeat))
+    results.update(bench_synthetic([50, 200, 1000], repeat))
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "quick": quick
+        },
+        "results": results
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Compare the results with a baseline, returns the list of regressions
+    (results worse than the baseline by more than tolerance, as a fraction)"""
+    regressions = []
+    for name, base in baseline["results"].items():
+        if name not in current["results"]:
+            print(f"{name:55s} missing")
+            continue
+        value = current["results"][name]["value"]
+        ratio = value / base["value"] if base["value"] > 0 else np.inf
+        worse = ratio > 1 + tolerance if base["better"] == "lower" else ratio < 1 / (1 + tolerance)
+        print(f"{name:55s} {base['value']:>14.4f} -> {value:>14.4f} {base['unit']:9s} x{ratio:.2f}{'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the FCM inference, the GA, the fuzzy terms and the server")
+    parser.add_argument("--output", default=None, help="write the results in this JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help=f"write the results as the new baseline ({baseline_path})")
+    parser.add_argument("--compare", action="store_true", help="compare the results with the baseline, exit code 1 if there are regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="fraction of slowdown flagged as a regression")
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.quick)
+    output = json.dumps(current, indent=4)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(output)
+    if args.save_baseline:
+        with open(baseline_path, "w") as f:
+            f.write(output)
+    if args.compare:
+        regressions = compare(current, json.load(open(baseline_path)), args.tolerance)
+        print(f"{len(regressions)} regressions")
+        sys.exit(1 if len(regressions) > 0 else 0)
+    if args.output is None and not args.save_baseline:
+        print(output)
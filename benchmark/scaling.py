@@ -0,0 +1,170 @@
+import sys
+import os
+import json
+import time
+import platform
+import argparse
+import tempfile
+
+# run from the root of the repository: python benchmark/scaling.py
+benchmark_path = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.dirname(benchmark_path)
+sys.path.insert(0, root_path)
+sys.path.insert(0, os.path.join(root_path, "utils"))
+sys.path.append(os.path.join(root_path, "my-tool", "backend"))
+
+import numpy as np
+import FLT_class
+import FCM_class
+import FCM_class_tool
+from FCM_class import FCM
+from benchmark import measure, result, iterations, threshold
+from generate_model import generate_model, write_model, to_structure
+
+# synthetic models: name -> (depth, branching, nodes of each leaf map, density)
+configs = {
+    "1k": (2, 10, 100, 0.1),
+    "10k": (2, 100, 100, 0.1),
+    "10k_wide": (2, 4, 2500, 0.01),
+    "100k": (2, 1000, 100, 0.1),
+    "100k_deep": (3, 32, 100, 0.1)
+}
+graph_max_nodes = 2000      # the graph engine is run only on the smallest models
+n_scenarios = 50            # rows of the batched runs, as a GA population
+backends = ("dense", "sparse")  # backends of the block diagonal matrices of the batched runs, see FCM_class.use_sparse
+
+
+def dense_bytes(sizes):
+    "Memory of the block diagonal matrix of maps with the given number of nodes"
+    return sum(sizes) ** 2 * 8
+
+
+def bench_config(name, depth, branching, nodes, density, flt, repeat, memory_budget, path):
+    """Generate a model in path and time each engine on it, the engines that do not fit the model are skipped with the reason.
+    The dense backend is skipped when its block diagonal matrix exceeds memory_budget (MB)."""
+    start = time.perf_counter()
+    model, case, lambdas = generate_model(depth, branching, nodes, density, seed=0)
+    write_model(model, case, lambdas, path)
+    FCM_class.model_path = os.path.join(path, "model")
+    FCM_class.cases_path = os.path.join(path, "cases")
+    compiled_model = FCM_class.load_model()
+    sizes = {idx: model[idx]["ww"].shape[0] for idx in model}
+    _, _, layers = FCM_class.model_hierarchy(compiled_model)
+    info = {
+        "depth": depth, "branching": branching, "nodes_per_map": nodes, "density": density,
+        "maps": len(model),
+        "nodes": sum(sizes.values()),
+        "edges": int(sum(np.count_nonzero(model[idx]["ww"]) for idx in model)),
+        "generation_s": round(time.perf_counter() - start, 3)
+    }
+    results = {}
+    skip = lambda reason: {"skipped": reason}
+    too_large = lambda n_bytes: f"dense block diagonal matrix of {n_bytes / 2**20:.0f} MB over the budget of {memory_budget} MB"
+
+    leaves = layers[0]
+    leaf_bytes = dense_bytes([sizes[idx] for idx in leaves])
+    n_genes = sum(sizes[idx] - 1 for idx in leaves)
+    genes = np.random.default_rng(0).choice([0.1, 0.3, 0.5, 0.7, 0.9], (n_scenarios, n_genes))
+
+    # FCM and run_fcm_batch run the leaf maps of a model with two layers
+    if depth == 2:
+        n_fcm = len(leaves)
+        leaf_lambdas = {idx: lambdas[idx] for idx in leaves}
+        # the graphs are built once, the build is the slowest step on the largest models
+        start = time.perf_counter()
+        fcm_obj = FCM(n_fcm, iterations, dict(leaf_lambdas), "synthetic", flt)
+        results["fcm/build"] = result((time.perf_counter() - start) * 1000, "ms")
+        if info["nodes"] <= graph_max_nodes:
+            def run_graph():
+                FCM(n_fcm, iterations, dict(leaf_lambdas), "synthetic", flt).run_fcm(threshold, engine="graph")
+            results["fcm/graph"] = result(measure(run_graph, repeat), "ms")
+        else:
+            results["fcm/graph"] = skip(f"more than {graph_max_nodes} nodes")
+        results["fcm/matrix"] = result(measure(lambda: fcm_obj.run_fcm(threshold, engine="matrix"), repeat), "ms")
+        results["fcm/final"] = result(measure(lambda: fcm_obj.run_fcm(threshold, engine="matrix", trajectories=False), repeat), "ms")
+
+        for backend in backends:
+            if backend == "dense" and leaf_bytes > memory_budget * 2**20:
+                results[f"batch/{backend}/1"] = results[f"batch/{backend}/{n_scenarios}"] = skip(too_large(leaf_bytes))
+                continue
+            results[f"batch/{backend}/1"] = result(measure(lambda: FCM_class.run_fcm_batch(["synthetic"], n_fcm, iterations, lambdas, flt, threshold, backend=backend), repeat), "ms")
+            results[f"batch/{backend}/{n_scenarios}"] = result(measure(lambda: FCM_class.run_fcm_batch(genes, n_fcm, iterations, lambdas, flt, threshold, backend=backend), repeat), "ms")
+    else:
+        reason = "FCM and run_fcm_batch run models with two layers"
+        for engine in ["fcm/build", "fcm/graph", "fcm/matrix", "fcm/final"] + [f"batch/{backend}/{n}" for backend in backends for n in (1, n_scenarios)]:
+            results[engine] = skip(reason)
+
+    # run_fcm_layered stacks one layer at a time
+    layer_bytes = max(dense_bytes([sizes[idx] for idx in layer]) for layer in layers)
+    for backend in backends:
+        if backend == "dense" and layer_bytes > memory_budget * 2**20:
+            results[f"layered/{backend}/1"] = results[f"layered/{backend}/{n_scenarios}"] = skip(too_large(layer_bytes))
+            continue
+        results[f"layered/{backend}/1"] = result(measure(lambda: FCM_class.run_fcm_layered(["synthetic"], iterations, lambdas, flt, threshold, backend=backend), repeat), "ms")
+        results[f"layered/{backend}/{n_scenarios}"] = result(measure(lambda: FCM_class.run_fcm_layered(genes, iterations, lambdas, flt, threshold, company_type="synthetic", backend=backend), repeat), "ms")
+
+    # FCM of the tool on the same model, as a structure
+    if depth == 2:
+        structure, activation_level = to_structure(model, case, lambdas)
+        results["tool/compile"] = result(measure(lambda: FCM_class_tool.compile_structure(structure), repeat), "ms")
+        compiled = FCM_class_tool.compile_structure(structure)
+        tool_obj = FCM_class_tool.FCM(iterations, structure, activation_level, flt, compiled=compiled)
+        results["tool/final"] = result(measure(lambda: tool_obj.run_fcm(threshold, engine="matrix", trajectories=False), repeat), "ms")
+    else:
+        results["tool/compile"] = results["tool/final"] = skip("the structure of the tool has only two layers")
+
+    return info, results
+
+
+def run_scaling(names, repeat, memory_budget):
+    flt = FLT_class.define_al_fuzzy()
+    models = {}
+    results = {}
+    for name in names:
+        with tempfile.TemporaryDirectory() as path:
+            info, config_results = bench_config(name, *configs[name], flt, repeat, memory_budget, path)
+        models[name] = info
+        results.update({f"scaling/{name}/{engine}": value for engine, value in config_results.items()})
+        print(f"{name}: {info['maps']} maps, {info['nodes']} nodes, {info['edges']} edges", file=sys.stderr)
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "memory_budget_mb": memory_budget,
+            "models": models
+        },
+        "results": results
+    }
+
+
+def print_table(report):
+    "Engines by rows and models by columns, times in milliseconds"
+    names = list(report["meta"]["models"])
+    engines = list(dict.fromkeys(key.split("/", 2)[2] for key in report["results"]))
+    print(f"{'':22s}" + "".join(f"{name:>14s}" for name in names))
+    print(f"{'nodes':22s}" + "".join(f"{report['meta']['models'][name]['nodes']:>14d}" for name in names))
+    print(f"{'edges':22s}" + "".join(f"{report['meta']['models'][name]['edges']:>14d}" for name in names))
+    for engine in engines:
+        row = f"{engine + ' (ms)':22s}"
+        for name in names:
+            value = report["results"].get(f"scaling/{name}/{engine}", {"skipped": ""})
+            row += f"{'-':>14s}" if "skipped" in value else f"{value['value']:>14.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scaling of the inference engines on synthetic models generated by utils/generate_model.py")
+    parser.add_argument("--models", nargs="+", default=list(configs), choices=list(configs), help="synthetic models to run")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of each measure")
+    parser.add_argument("--memory-budget", type=int, default=1024, help="MB allowed for a dense block diagonal matrix, larger ones are skipped")
+    parser.add_argument("--output", default=None, help="write the report in this JSON file")
+    args = parser.parse_args()
+
+    report = run_scaling(args.models, args.repeat, args.memory_budget)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    print_table(report)
@@ -1,7 +1,12 @@
-import pickle
-from utils.GA_class import *
+import sys
+import os
+import pandas as pd
 from utils.FLT_class import *
 
+# the columnar store of the results is read with GA_results.py, in the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from GA_results import load_results
+
 def find_differences(arr1, arr2):
     indices = []
 
@@ -15,8 +20,8 @@ def find_differences(arr1, arr2):
 
 cases_path = "cases"
 company_types = ['low', 'mix']
-results_tot = pickle.load(open('ga_results/results.pkl', 'rb'))
-n_runs = 10
+# only the best genes of the runs are read
+results_tot = load_results('ga_results/results.npz', company_types[1:], columns=['best_genes'])
 flt = define_al_fuzzy()
 
 for company_type in company_types[1:]:
@@ -29,10 +34,11 @@ for company_type in company_types[1:]:
             initial_values.append(flt.get_value(al[x][0]))
 
     differences = {}
-    results, results_pop, results_gen, time_taken = results_tot[company_type]
+    results = results_tot[company_type]['best_genes']
+    n_runs = len(results)
     for i in range(n_runs):
         indices, num_differences = find_differences(initial_values, results[i])
         differences[i] = (indices, num_differences)
     
     for i in range(n_runs):
-        print(f"run {i+1}: {differences[i][1]} differences")
\ No newline at end of file
+        print(f"run {i+1}: {differences[i][1]} differences")
@@ -1,87 +1,213 @@
-import networkx as nx
 import numpy as np
 import json
-import matplotlib.pyplot as plt
 from random import randint
 import copy
 import FLT_class
-import pandas as pd
 import glob
 import random
+import hashlib
+import FCM_binary
+import FCM_engine
+from FCM_engine import solvers, weight_operator, block_diagonal, solve_blocks
 
 model_path = "model"
 cases_path = "cases"
 colors = ['b', 'g', 'r', 'c', 'm', 'y', 'k', 'w']
 
+# compiled structures, keyed by a content hash of the structure
+_compiled_structures = {}
+max_compiled_structures = 32
+
+
+# fields of the nodes and of the transitions defining a structure, the others (activation levels, positions of the
+# frontend, ...) change on every request and are ignored by the compiled structures
+node_fields = ("id", "role", "meanings", "targets", "lambda")
+transition_fields = ("from", "to", "weight")
+
+
+def structure_topology(structure):
+    "Nodes and transitions of a structure with only node_fields and transition_fields"
+    return {
+        "nodes": [{field: node[field] for field in node_fields if field in node} for node in structure['nodes']],
+        "transitions": [{field: elem[field] for field in transition_fields} for elem in structure['transitions']]
+    }
+
+
+def structure_hash(structure):
+    "Content hash of the topology of a structure (see structure_topology), the same for every activation level"
+    return hashlib.sha256(json.dumps(structure_topology(structure), sort_keys=True).encode()).hexdigest()
+
+
+def compile_structure(structure):
+    """Parse a structure once: roles of the nodes, lambdas, and nodes, weights and weight operator (see weight_operator) of each sub-FCM.
+    Only the topology of the structure is read (see structure_topology), so the compiled structure can be shared by
+    all the structures with the same hash. The compiled structure must not be modified."""
+    structure = structure_topology(structure)
+    compiled = {"root": None, "intermediate": [], "final": [], "all_nodes": {}, "lambdas": {}, "sub_fcms": {}}
+    intermediate = compiled["intermediate"]
+    all_nodes = compiled["all_nodes"]
+
+    for node in structure['nodes']:
+        '''
+        {
+            "id": 0,
+            "role": "root",
+            "meanings": ["Smart Manufacturing"],
+            "targets": [1, 7, 8, 10, 11, 12]
+        }
+        '''
+        node_id = node['id']
+        node_role = node['role']
+        if node_role == "root":
+            compiled["root"] = node_id
+            all_nodes[node_id] = copy.deepcopy(node)
+            continue
+        elif node_role == "intermediate":
+            intermediate.append(node_id)
+            all_nodes[node_id] = copy.deepcopy(node)
+            compiled["lambdas"][node_id] = node['lambda']
+        elif node_role == "final":
+            compiled["final"].append(node_id)
+            all_nodes[node_id] = copy.deepcopy(node)
+
+    transitions_from = {}
+    intermediate_set = set(intermediate)
+    for elem in structure['transitions']:
+        '''
+        {
+            "from": 0,
+            "to": 1,
+            "weight": 0.5
+        }
+        '''
+        from_node = elem['from']
+        to_node = elem['to']
+        weight = elem['weight']
+        if from_node not in transitions_from:
+            transitions_from[from_node] = {}
+        transitions_from[from_node][to_node] = weight
+
+        if to_node in intermediate_set:
+            if 'destination_of' not in all_nodes[to_node]:
+                all_nodes[to_node]['destination_of'] = []
+            all_nodes[to_node]['destination_of'].append(from_node)
+
+    for node_id in intermediate:
+        nodes_to_consider = [node_id] + all_nodes[node_id]["destination_of"]
+        # edges of the graph and dense weight matrix, in the order of nodes_to_consider
+        # only the transitions of the nodes are visited, in the order of the positions of their targets
+        position = {j: b for b, j in enumerate(nodes_to_consider)}
+        edges = []
+        weights = np.zeros((len(nodes_to_consider), len(nodes_to_consider)))
+        for a, i in enumerate(nodes_to_consider):
+            targets = sorted((position[j], j) for j in transitions_from.get(i, {}) if j in position)
+            for b, j in targets:
+                ww_ij = transitions_from[i][j]
+                if (ww_ij != 0):
+                    edges.append((i, j, round(ww_ij, 5)))
+                    weights[a][b] = round(ww_ij, 5)
+        weights.setflags(write=False)
+        compiled["sub_fcms"][node_id] = {"nodes": nodes_to_consider, "edges": edges, "weights": weights, "operator": weight_operator(weights)}
+
+    return compiled
+
+
+def get_compiled_structure(structure):
+    "Compiled structure, compiled only the first time the same structure is seen"
+    key = structure_hash(structure)
+    if key not in _compiled_structures:
+        if len(_compiled_structures) >= max_compiled_structures:
+            _compiled_structures.pop(next(iter(_compiled_structures)))     # remove the oldest structure
+        _compiled_structures[key] = compile_structure(structure)
+    return _compiled_structures[key]
+
+
+def save_compiled_structure(structure, output):
+    "Compile a structure and pack it in a single binary file, loaded with load_compiled_structure"
+    compiled = compile_structure(structure)
+    header = {
+        "structure_hash": structure_hash(structure),
+        "hash_fields": [list(node_fields), list(transition_fields)],
+        "root": compiled["root"],
+        "intermediate": compiled["intermediate"],
+        "final": compiled["final"],
+        "all_nodes": list(compiled["all_nodes"].values()),
+        "lambdas": [[node_id, value] for node_id, value in compiled["lambdas"].items()],
+        "sub_fcms": [{"id": node_id, "nodes": sub_fcm["nodes"], "edges": sub_fcm["edges"]} for node_id, sub_fcm in compiled["sub_fcms"].items()]
+    }
+    matrices = {f"weights/{node_id}": sub_fcm["weights"] for node_id, sub_fcm in compiled["sub_fcms"].items()}
+    FCM_binary.write_model(output, header, matrices)
+    return output
+
+
+def load_compiled_structure(path):
+    """Load a structure packed by save_compiled_structure, with the weight matrices memory-mapped read-only.
+    The compiled structure is registered as the one of the original structure, so get_compiled_structure
+    does not compile it again. Returns the compiled structure, or None if the file was hashed on other fields."""
+    header, matrices = FCM_binary.read_model(path)
+    if header.get("hash_fields") != [list(node_fields), list(transition_fields)]:
+        print(f"{path} was hashed on other fields, it is never found by the requests: compile the model again")
+        return None
+    compiled = {
+        "root": header["root"],
+        "intermediate": header["intermediate"],
+        "final": header["final"],
+        "all_nodes": {node["id"]: node for node in header["all_nodes"]},
+        "lambdas": {node_id: value for node_id, value in header["lambdas"]},
+        "sub_fcms": {sub_fcm["id"]: {"nodes": sub_fcm["nodes"], "edges": [tuple(edge) for edge in sub_fcm["edges"]], "weights": matrices[f"weights/{sub_fcm['id']}"], "operator": weight_operator(matrices[f"weights/{sub_fcm['id']}"])} for sub_fcm in header["sub_fcms"]}
+    }
+    _compiled_structures[header["structure_hash"]] = compiled
+    return compiled
+
+
 class FCM:
 
-    def __init__(self, iterations, structure, activation_level, flt, new_values=[]):
+    def __init__(self, iterations, structure, activation_level, flt, new_values=[], compiled=None):
         self.iterations = iterations
         self.al_flt = flt
         self.flt = flt
-        self.lambdas = {}
-        self.model : dict[nx.DiGraph] = self.build_model(structure, activation_level, new_values=new_values)
+        # structure already compiled (e.g. with get_compiled_structure), only the activation levels are bound
+        self.compiled = compiled if compiled is not None else compile_structure(structure)
+        self.lambdas = dict(self.compiled["lambdas"])
+        self.graphs = None
+        self.build_model(structure, activation_level, new_values=new_values)
+
+
+    @property
+    def model(self) -> "dict[nx.DiGraph]":
+        "Graphs of the sub-FCMs, built on first use: only the graph engine and the trajectories of the matrix engine need them"
+        if self.graphs is None:
+            self.graphs = {node_id: self.sub_fcm_graph(node_id) for node_id in self.initial_values}
+        return self.graphs
+
+
+    def sub_fcm_graph(self, node_id):
+        "Graph of an enabled sub-FCM with its initial activation levels"
+        import networkx as nx
+        sub_fcm = self.compiled["sub_fcms"][node_id]
+        G = nx.DiGraph(depth=0)
+        # add nodes (the intermediate node first, then the final ones)
+        # "value" is an array representing the activation level through the iterations
+        # (only the initial one here, the iterations are stored by run_fcm)
+        for n, value in zip(sub_fcm["nodes"], self.initial_values[node_id].tolist()):
+            G.add_node(n, attr_dict = {"value":[value]})
+        # edges of the graph
+        G.add_weighted_edges_from(sub_fcm["edges"])
+        return G
 
 
     def build_model(self, structure, activation_level, new_values=[]):
-        "Build the FCM model"
-        graph_list = {}
+        "Bind the activation levels to the compiled structure, the graphs are built by model"
         self.desc_graphs = {}
-        idx_new_values = 0
+        self.weight_matrices = {}
+        self.weight_operators = {}
+        self.initial_values = {}
 
         self.idx_to_remove = []
 
-        self.root = None
-        intermediate = []
-        final = []
-        
-        nodes = structure['nodes']
-        transitions = structure['transitions']
-
-        self.all_nodes = {}
-        for node in nodes:
-            '''
-            {
-                "id": 0,
-                "role": "root",
-                "meanings": ["Smart Manufacturing"],
-                "targets": [1, 7, 8, 10, 11, 12]
-            }
-            '''
-            node_id = node['id']
-            node_role = node['role']
-            if node_role == "root":
-                self.root = node_id
-                self.all_nodes[node_id] = node
-                continue
-            elif node_role == "intermediate":
-                intermediate.append(node_id)
-                self.all_nodes[node_id] = node
-                self.lambdas[node_id] = node['lambda']
-            elif node_role == "final":
-                final.append(node_id)
-                self.all_nodes[node_id] = node
-        
-        transitions_from = {}
-        for elem in transitions:
-            '''
-            {
-                "from": 0,
-                "to": 1,
-                "weight": 0.5
-            }
-            '''
-            from_node = elem['from']
-            to_node = elem['to']
-            weight = elem['weight']
-            if from_node not in transitions_from:
-                transitions_from[from_node] = {}
-            transitions_from[from_node][to_node] = weight
-
-            if to_node in intermediate:
-                if 'destination_of' not in self.all_nodes[to_node]:
-                    self.all_nodes[to_node]['destination_of'] = []
-                self.all_nodes[to_node]['destination_of'].append(from_node)
+        self.root = self.compiled["root"]
+        intermediate = self.compiled["intermediate"]
+        self.all_nodes = self.compiled["all_nodes"]
 
         all_nodes_al = {}
         for node in activation_level:
@@ -95,92 +221,99 @@ class FCM:
 
         for node_id in intermediate:
             if node_id not in self.idx_to_remove:
-                node_info = self.all_nodes[node_id]
-
-                G = nx.DiGraph(depth=0)
-                destination_of = node_info["destination_of"]
-
-                # add nodes
-                # "value" is an array representing the activation level through the iterations
-                if len(new_values) == 0:    # if doing inference
-                    # add the intermediate node
-                    G.add_node(node_id, attr_dict = {"value":[0]*self.iterations})
-                    l_al = all_nodes_al[node_id]['weight']
-                    v_al = self.flt.get_value(l_al)
-                    G.nodes[node_id]['attr_dict']['value'][0] = round(v_al, 5)
-                    # add final nodes
-                    for other_node_id in destination_of:
-                        G.add_node(other_node_id, attr_dict = {"value":[0]*self.iterations})
-                        l_al = all_nodes_al[other_node_id]['weight']
-                        v_al = self.flt.get_value(l_al)
-                        G.nodes[other_node_id]['attr_dict']['value'][0] = round(v_al, 5)
-                else:   # if doing genetic algorithm
-                    # add the intermediate node
-                    G.add_node(node_id, attr_dict = {"value":[0]*self.iterations})
-                    l_al = all_nodes_al[node_id]['weight']
-                    v_al = self.flt.get_value(l_al)
-                    G.nodes[node_id]['attr_dict']['value'][0] = round(v_al, 5)
-                    # add final nodes
-                    for other_node_id in destination_of:
-                        G.add_node(other_node_id, attr_dict = {"value":[0]*self.iterations})
-                        l_al = all_nodes_al[other_node_id]['weight']
-                        G.nodes[other_node_id]['attr_dict']['value'][0] = round(l_al, 5)
-
-                nodes_to_consider = [node_id] + destination_of
-                # edges of the graph
-                for i in nodes_to_consider:
-                    for j in nodes_to_consider:
-                        ww_ij = transitions_from[i][j] if i in transitions_from and j in transitions_from[i] else 0
-                        if (ww_ij != 0): G.add_edge(i, j, weight = round(ww_ij, 5))
-
-                graph_list[node_id] = G
-
-        return graph_list
-    
-    def run_fcm(self, threshold=0.001):
-        "Run the FCM algorithm"
+                sub_fcm = self.compiled["sub_fcms"][node_id]
+                # initial activation levels, the intermediate node first: the final nodes are linguistic terms
+                # if doing inference, numeric activation levels if doing genetic algorithm
+                values = [self.flt.get_value(all_nodes_al[node_id]['weight'])]
+                for other_node_id in sub_fcm["nodes"][1:]:
+                    l_al = all_nodes_al[other_node_id]['weight']
+                    values.append(self.flt.get_value(l_al) if len(new_values) == 0 else l_al)
+
+                # dense weight matrix and initial activation vector used by the matrix engine
+                self.weight_matrices[node_id] = sub_fcm["weights"]
+                self.weight_operators[node_id] = sub_fcm["operator"]
+                self.initial_values[node_id] = np.array([round(v, 5) for v in values], dtype=float)
+
+
+    def run_fcm(self, threshold=0.001, engine="graph", trajectories=True, backend="auto", solver="papageorgiou"):
+        """Run the FCM algorithm, engine is 'graph' (networkx) or 'matrix' (numpy).
+        backend is the format of the weight matrices of the matrix engine, 'dense', 'sparse' or 'auto' (see use_sparse).
+        With trajectories=False (matrix engine only) only the final activation levels are kept,
+        in final_values, and the graphs are not updated.
+        solver is one of solvers: the fixed point ones (matrix engine and trajectories=False only) stop when all the nodes
+        change by less than threshold. The iterations and the residual of each sub-FCM are stored in solver_stats."""
         self.model_out = {}
+        self.final_values = {}
+        self.solver_stats = {}
+        if not trajectories and engine != "matrix":
+            raise ValueError("trajectories=False requires the matrix engine")
+        if solver not in solvers:
+            raise ValueError(f"Unknown solver: {solver}, expected one of {solvers}")
+        if solver != "papageorgiou" and trajectories:
+            raise ValueError(f"The {solver} solver requires the matrix engine and trajectories=False")
 
         # run the algorithm for each FCM
-        for key in self.model.keys():
+        for key in self.initial_values.keys():
             lambda_value = self.lambdas[key]
-            G, t = FCM.papageorgiou_alg_graph(self.model[key], key, start_iter=1, end_iter=self.iterations+1, lambda_value=lambda_value, threshold=threshold)
-            for n in G.nodes:
-                G.nodes[n]['attr_dict']['value'] = G.nodes[n]['attr_dict']['value'][:t]
+            operator = self.weight_operators[key] if backend == "auto" else weight_operator(self.weight_matrices[key], backend)
+            if engine == "graph":
+                G, t = FCM.papageorgiou_alg_graph(self.model[key], key, start_iter=1, end_iter=self.iterations+1, lambda_value=lambda_value, threshold=threshold)
+                for n in G.nodes:
+                    G.nodes[n]['attr_dict']['value'] = G.nodes[n]['attr_dict']['value'][:t]
+                self.final_values[key] = np.array([G.nodes[n]['attr_dict']['value'][-1] for n in G.nodes])
+                self.solver_stats[key] = {"iterations": t, "residual": None}
+            elif engine == "matrix" and solver != "papageorgiou":
+                self.final_values[key], t, residual = FCM.fixed_point(operator, self.initial_values[key], self.iterations, lambda_value, threshold, solver)
+                self.solver_stats[key] = {"iterations": t, "residual": residual}
+                continue
+            elif engine == "matrix" and not trajectories:
+                self.final_values[key], t = FCM.papageorgiou_alg_final(operator, self.initial_values[key], start_iter=1, end_iter=self.iterations+1, lambda_value=lambda_value, threshold=threshold)
+                self.solver_stats[key] = {"iterations": t, "residual": None}
+                continue
+            elif engine == "matrix":
+                values, t = FCM.papageorgiou_alg_matrix(operator, self.initial_values[key], start_iter=1, end_iter=self.iterations+1, lambda_value=lambda_value, threshold=threshold)
+                # store the trajectories in the graph so that the output is the same of the graph engine
+                G = self.model[key]
+                for i, n in enumerate(G.nodes):
+                    G.nodes[n]['attr_dict']['value'] = values[:t, i].tolist()
+                self.final_values[key] = values[t-1]
+                self.solver_stats[key] = {"iterations": t, "residual": None}
+            else:
+                raise ValueError(f"Unknown engine: {engine}")
             self.model_out[key] = G
 
-        # compute the number of max iterations in the graphs
-        max_iter = 0
-        for key in self.model_out.keys():
-            if len(self.model_out[key].nodes[key]['attr_dict']['value']) > max_iter:
-                max_iter = len(self.model_out[key].nodes[key]['attr_dict']['value'])
-        
-        # add the missing iterations to the activation levels of the nodes
-        # the last value is repeated until the max_iter is reached
-        for key in self.model_out.keys():
-            if max_iter > len(self.model_out[key].nodes[key]['attr_dict']['value']):
-                for n in self.model_out[key].nodes:
-                    idx_iter = len(self.model_out[key].nodes[n]['attr_dict']['value'])
-                    while idx_iter < max_iter:
-                        self.model_out[key].nodes[n]['attr_dict']['value'].append(self.model_out[key].nodes[n]['attr_dict']['value'][-1])
-                        idx_iter += 1
+        # the trajectories keep their own length, aligned_trajectories pads them to a common length
 
         # compute the final activation level of the main node
         weight_mean = 0
         n_elem = 0
-        for key in self.model_out.keys():
-            weight_mean += self.model_out[key].nodes[key]['attr_dict']['value'][-1]
+        for key in self.final_values.keys():
+            weight_mean += float(self.final_values[key][0])
             n_elem += 1
         self.main_final_al = weight_mean / n_elem
 
         return
 
 
+    def aligned_trajectories(self):
+        """Trajectories of the sub-FCMs (iterations x nodes), padded by repeating the last activation levels to the length of the longest one.
+        Used by print_weights_nodes and plot_al_values_graphs, they are kept only by run_fcm with trajectories=True"""
+        if len(getattr(self, "model_out", {})) == 0:
+            raise ValueError("No trajectories to show: run_fcm kept only the final activation levels (final_values), run it with trajectories=True")
+        trajectories = {key: np.array([G.nodes[n]['attr_dict']['value'] for n in G.nodes]).T for key, G in self.model_out.items()}
+        max_iter = max(len(values) for values in trajectories.values())
+        return {key: np.pad(values, ((0, max_iter - len(values)), (0, 0)), mode='edge') for key, values in trajectories.items()}
+
+
     @staticmethod
     def papageorgiou_alg_graph(graph, key_node, start_iter, end_iter, lambda_value, threshold=0.001):
         "E.I. Papageorgiou, 'A new methodology for Decisions in Medical Informatics using fuzzy cognitive maps based on fuzzy rule-extraction techniques', Applied Soft Computing, vol. 11, Issue 1, p.p. 500-513, 2011."
         G = graph
 
+        # the activation levels of the iterations are allocated only when the graph engine runs
+        for node in G:
+            G.nodes[node]['attr_dict']['value'] += [0] * (end_iter - len(G.nodes[node]['attr_dict']['value']))
+
         for t in range(start_iter,end_iter):    #for each iteration
             for node in G:  #for each node in the graph
                 # contribution of the incoming edges
@@ -211,17 +344,18 @@ class FCM:
         return G, t
 
 
-    @staticmethod
-    def sigmoid(x, lambda_value):
-        "Sigmoid function"
-        return 1/(1+np.exp(-lambda_value*x))
-    
+    # matrix engines of a sub-FCM (the key node is the first one), see FCM_engine
+    papageorgiou_alg_matrix = staticmethod(FCM_engine.papageorgiou_alg_matrix)
+    papageorgiou_alg_final = staticmethod(FCM_engine.papageorgiou_alg_final)
+    papageorgiou_alg_iter = staticmethod(FCM_engine.papageorgiou_alg_iter)
+    fixed_point = staticmethod(FCM_engine.fixed_point)
+    sigmoid = staticmethod(FCM_engine.sigmoid)
+
 
     def generate_al_values(self):
         final_al_nodes = []
-        for key in self.model_out.keys():
-            for n in self.model_out[key].nodes:
-                final_al = self.model_out[key].nodes[n]['attr_dict']['value'][-1]
+        for key in self.final_values.keys():
+            for n, final_al in zip(self.compiled["sub_fcms"][key]["nodes"], self.final_values[key].tolist()):
                 final_flt = self.al_flt.get_linguisitic_term(final_al)
                 dict_al = {
                     "id": n, 
@@ -243,13 +377,14 @@ class FCM:
 
     def print_weights_nodes(self):
         "Print the weights of the nodes of the final graph"
+        trajectories = self.aligned_trajectories()
         for key in self.model_out.keys():
             # grafo i-esimo
             to_print = f"FCM {', '.join(self.all_nodes[key]['meanings'])}\n"
-            for n in self.model_out[key].nodes:
+            for i, n in enumerate(self.model_out[key].nodes):
                 # nodo n-esimo
                 to_print += f"\t{', '.join(self.all_nodes[n]['meanings'])}:\t"
-                to_print += f"{self.model_out[key].nodes[n]['attr_dict']['value']}\n"
+                to_print += f"{trajectories[key][:, i].tolist()}\n"
                 pass
             print(to_print)
 
@@ -259,14 +394,9 @@ class FCM:
         initial_activation_levels = []
         final_activation_level = []
         name_fcm = []
-        for key in self.model_out.keys():
-            results_in = []
-            results_out = []
-            for j in self.model_out[key].nodes:
-                results_in.append(self.model_out[key].nodes[j]['attr_dict']['value'][0])
-                results_out.append(self.model_out[key].nodes[j]['attr_dict']['value'][-1])
-            initial_activation_levels.append(results_in)
-            final_activation_level.append(results_out)
+        for key in self.final_values.keys():
+            initial_activation_levels.append(self.initial_values[key].tolist())
+            final_activation_level.append(self.final_values[key].tolist())
             name_fcm.append(", ".join(self.all_nodes[key]['meanings']))
         return initial_activation_levels, final_activation_level, name_fcm
 
@@ -291,17 +421,71 @@ class FCM:
             print(f"\t\t  {ling_final[i]}")
 
 
+def activation_values(compiled, activation_level, flt, numeric=False):
+    """Initial activation levels of an activation_level list, as a vector indexed by node id.
+    The weights are linguistic terms, or numbers if numeric is True."""
+    values = np.zeros(max(compiled["all_nodes"]) + 1)
+    for node in activation_level:
+        if node['id'] in compiled["all_nodes"]:
+            weight = node['weight'] if numeric else flt.get_value(node['weight'])
+            values[node['id']] = round(weight, 5)
+    return values
+
+
+def enabled_intermediate(compiled, activation_level):
+    "Intermediate nodes enabled in an activation_level list"
+    disabled = [node['id'] for node in activation_level if node['id'] in compiled["intermediate"] and not node['enabled']]
+    return [node_id for node_id in compiled["intermediate"] if node_id not in disabled]
+
+
+def run_fcm_batch(compiled, values, enabled, iterations, threshold=0.001, backend="auto", solver="papageorgiou", return_stats=False):
+    """Run the FCM on N scenarios at once.
+    values is a (N x nodes) matrix of initial activation levels, indexed by node id, enabled the intermediate nodes to run.
+    The sub-FCMs are stacked in one block diagonal matrix (dense or CSR, see block_diagonal) and each scenario stops independently on each sub-FCM,
+    as FCM.run_fcm with the matrix engine and the same solver.
+    Returns the N final activation levels of the root and a (N x nodes) matrix with the final activation levels
+    of the nodes of the enabled sub-FCMs (and of the root). With return_stats a dict with the (N x enabled) iterations
+    and residuals of the fixed point solvers (None with the papageorgiou solver) is returned too."""
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    sub_fcms = [compiled["sub_fcms"][node_id] for node_id in enabled]
+    columns = np.array([n for sub_fcm in sub_fcms for n in sub_fcm["nodes"]], dtype=int)   # node id of each column
+    sizes = [len(sub_fcm["nodes"]) for sub_fcm in sub_fcms]
+    offsets = np.cumsum([0] + sizes[:-1]).astype(int)  # column of the key node of each sub-FCM
+
+    # block diagonal weight matrix, lambda and sub-FCM of each column
+    n_columns = len(columns)
+    ww_all = block_diagonal([sub_fcm["weights"] for sub_fcm in sub_fcms], backend)
+    lambda_all = np.zeros(n_columns)
+    group = np.zeros(n_columns, dtype=int)
+    for k in range(len(sub_fcms)):
+        start, end = offsets[k], offsets[k] + sizes[k]
+        lambda_all[start:end] = compiled["lambdas"][enabled[k]]
+        group[start:end] = k
+
+    state, iterations_stats, residual = solve_blocks(ww_all, lambda_all, group, offsets, values[:, columns], iterations, threshold, solver)
+    stats = {"iterations": iterations_stats, "residual": residual}
+
+    main_final_al = state[:, offsets].sum(axis=1) / len(sub_fcms)
+    final_values = np.zeros_like(values)
+    final_values[:, columns] = state
+    final_values[:, compiled["root"]] = main_final_al
+    if return_stats:
+        return main_final_al, final_values, stats
+    return main_final_al, final_values
+
+
 def plot_al_values_graphs(models, company, colors):
     "Plot the activation levels of the main node of multiple FCM"
+    import matplotlib.pyplot as plt
     if "_" in company:
         company = " ".join(company.split("_"))
     plt.figure()
     plt.grid()
     n_iter = 100
     idx_color = 0
-    for key in models.model_out.keys():
-        g = models.model_out[key]
-        y_val = g.nodes[key]['attr_dict']['value']
+    trajectories = models.aligned_trajectories()
+    for key in trajectories.keys():
+        y_val = trajectories[key][:, 0].tolist()
         if len(y_val) < n_iter:
             n_iter = len(y_val)
         x_val = list(range(len(y_val)))
@@ -317,9 +501,8 @@ def plot_al_values_graphs(models, company, colors):
     y_val_main = []
     while idx_iter < n_iter:
         y_val_mean = []
-        for key in models.model_out.keys():
-            g = models.model_out[key]
-            y_val_mean.append(g.nodes[key]['attr_dict']['value'][idx_iter])
+        for key in trajectories.keys():
+            y_val_mean.append(trajectories[key][idx_iter, 0])
         y_val_main.append(np.mean(y_val_mean))
         idx_iter += 1
     plt.figure()
@@ -334,6 +517,7 @@ def plot_al_values_graphs(models, company, colors):
 
 
 def plot_sigmoid(lambda_values):
+    import matplotlib.pyplot as plt
     plt.figure()
 
     c_i = 0
@@ -359,6 +543,8 @@ def plot_sigmoid(lambda_values):
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     config = json.load(open("config.json"))
     to_remove = config['to_remove']
     company = config['case']
@@ -0,0 +1,258 @@
+import numpy as np
+
+# numeric engines of the FCM, shared by FCM_class.py and the backend of the tool (my-tool/backend/FCM_engine.py is a copy
+# of this file, as FLT_class.py and FCM_binary.py): the update of the activation levels, the papageorgiou iterations on
+# a vector or on N scenarios of stacked sub-FCMs, and the fixed point solvers
+
+sparse_density = 0.05   # weight matrices with less non-zero weights than this fraction...
+sparse_min_nodes = 500  # ...and at least these nodes use the sparse (CSR) backend, see use_sparse
+# 'papageorgiou' stops on the key node of each map (FCM.papageorgiou_alg_graph), the others find the steady state (solve_fixed_point)
+solvers = ("papageorgiou", "picard", "anderson", "aitken")
+
+
+def use_sparse(n_nodes, n_weights, backend="auto"):
+    """True if a weight matrix with n_nodes and n_weights non-zero weights runs with the sparse backend:
+    backend is 'dense', 'sparse' or 'auto' (sparse for large matrices with density below sparse_density)"""
+    if backend not in ("auto", "dense", "sparse"):
+        raise ValueError(f"Unknown backend: {backend}")
+    if backend == "auto":
+        return n_nodes >= sparse_min_nodes and n_weights < sparse_density * n_nodes ** 2
+    return backend == "sparse"
+
+
+def weight_operator(ww, backend="auto"):
+    "Weight matrix in the format of the backend, a CSR matrix (scipy.sparse) or ww itself: c @ weight_operator(ww) is c @ ww"
+    if use_sparse(ww.shape[0], np.count_nonzero(ww), backend):
+        from scipy import sparse
+        return sparse.csr_array(ww)
+    return ww
+
+
+def block_diagonal(blocks, backend="auto"):
+    """Block diagonal matrix of the weight matrices of the sub-FCMs, in the format of the backend:
+    with the sparse one memory and time of the iterations grow with the weights, not with the square of the nodes"""
+    n_nodes = sum(ww.shape[0] for ww in blocks)
+    if use_sparse(n_nodes, sum(np.count_nonzero(ww) for ww in blocks), backend):
+        from scipy import sparse
+        return sparse.block_diag([sparse.csr_array(ww) for ww in blocks], format="csr")
+    ww_all = np.zeros((n_nodes, n_nodes))
+    start = 0
+    for ww in blocks:
+        ww_all[start:start+ww.shape[0], start:start+ww.shape[0]] = ww
+        start += ww.shape[0]
+    return ww_all
+
+
+def sigmoid(x, lambda_value):
+    "Sigmoid function"
+    return 1/(1+np.exp(-lambda_value*x))
+
+
+def papageorgiou_alg_matrix(ww, initial_values, start_iter, end_iter, lambda_value, threshold=0.001):
+    "Matrix form of FCM.papageorgiou_alg_graph: one matvec and one vectorized sigmoid per iteration, ww is dense or CSR"
+    n = ww.shape[0]
+    values = np.zeros((end_iter, n))
+    values[0] = initial_values
+
+    for t in range(start_iter, end_iter):    #for each iteration
+        c = 2 * values[t-1] - 1     # C_j^t = 2 * A_j^(t-1) - 1
+        b = c @ ww                  # B_i^t = sum(w_ji * C_j^t)
+        x = b + 2 * values[t-1] - 1     # X_i^t = B_i^t + 2 * A_i^(t-1) - 1
+        values[t] = np.round(sigmoid(x, lambda_value), 5)   # A_i^t = sigmoid(X_i^t)
+
+        # same stop rule of the graph version, based on node 0
+        if abs(values[t][0] - values[t-1][0]) < threshold:
+            return values, t
+
+    return values, t
+
+
+def papageorgiou_alg_final(ww, initial_values, start_iter, end_iter, lambda_value, threshold=0.001):
+    "papageorgiou_alg_matrix keeping only the last two activation vectors, returns the final one (the one kept by FCM.run_fcm)"
+    for t, values in enumerate(papageorgiou_alg_iter(ww, initial_values, start_iter, end_iter, lambda_value, threshold), 1):
+        pass
+    return values, t
+
+
+def papageorgiou_alg_iter(ww, initial_values, start_iter, end_iter, lambda_value, threshold=0.001):
+    """papageorgiou_alg_matrix as a generator of the activation vectors of the iterations kept by FCM.run_fcm
+    (the initial one included, the one of the stopping iteration excluded)"""
+    previous = np.asarray(initial_values, dtype=float)
+    yield previous
+
+    for t in range(start_iter, end_iter):    #for each iteration
+        values = np.round(sigmoid((2 * previous - 1) @ ww + 2 * previous - 1, lambda_value), 5)
+        if abs(values[0] - previous[0]) < threshold or t == end_iter - 1:
+            return
+        yield values
+        previous = values
+
+
+def error_bound(residual, rate, max_rate=0.999):
+    """Bound rate / (1 - rate) * residual of the distance of update(A) from the steady state, for a map contracting
+    by rate (the largest secant estimate of the iterations, at most max_rate): the maps of the model contract slowly,
+    a small residual alone leaves update(A) far from the steady state. The secant estimates are lower than the
+    actual rate, the bound is doubled. nan while the rate is unknown."""
+    rate = np.minimum(rate, max_rate)
+    return 2 * residual * rate / (1 - rate)
+
+
+def fixed_point(ww, initial_values, max_iter, lambda_value, threshold=0.001, solver="anderson", memory=5, cycle=8):
+    """Steady state of a sub-FCM (ww is dense or CSR) with at most max_iter evaluations of the map:
+    solve_fixed_point on a single vector, without the bookkeeping of the scenarios and of the sub-FCMs.
+    Returns the activation levels, the number of iterations and the residual"""
+    if solver not in solvers[1:]:
+        raise ValueError(f"Unknown fixed point solver: {solver}, expected one of {solvers[1:]}")
+    update = lambda values: sigmoid((2 * values - 1) @ ww + 2 * values - 1, lambda_value)
+    x = np.asarray(initial_values, dtype=float)
+    fx = update(x)
+    residual = np.abs(fx - x).max()
+    rate = np.nan   # contraction rate of the map, see error_bound
+    t = 1
+    g_history, f_history = [], []
+    chain = [x]
+
+    while not error_bound(residual, rate) < threshold and t < max_iter:
+        x_previous, fx_previous = x, fx
+        new_x = fx
+        if solver == "anderson":
+            f = fx - x
+            if len(g_history) > 0:
+                dG = fx[:, None] - np.array(g_history).T
+                dF = f[:, None] - np.array(f_history).T
+                gram = dF.T @ dF
+                gram += np.eye(len(g_history)) * (1e-10 * np.trace(gram) + 1e-14)
+                new_x = fx - dG @ np.linalg.solve(gram, dF.T @ f)
+            g_history = (g_history + [fx])[-memory:]
+            f_history = (f_history + [f])[-memory:]
+        elif solver == "aitken":
+            chain.append(fx)
+            if len(chain) == cycle + 1:
+                d1 = chain[-1] - chain[-2]
+                d2 = chain[-1] - 2 * chain[-2] + chain[-3]
+                norm = d2 @ d2
+                new_x = fx - (d2 @ d1 / norm if norm > 0 else 0) * d1
+        x = np.clip(new_x, 0, 1)
+        if len(chain) == cycle + 1:
+            chain = [x]
+        fx = update(x)
+        residual = np.abs(fx - x).max()
+        step = np.abs(x - x_previous).max()
+        if step > 0:
+            rate = np.fmax(rate, np.abs(fx - fx_previous).max() / step)
+        t += 1
+
+    return np.round(fx, 5), t, float(residual)
+
+
+def run_fcm_blocks(ww_all, lambda_all, group, key_nodes, values, iterations, threshold=0.001, fixed=None):
+    """Run the sub-FCMs stacked in the block diagonal matrix ww_all (dense or CSR) on a (N x nodes) matrix of initial activation levels.
+    group is the sub-FCM of each column and key_nodes the column of the node that stops each sub-FCM:
+    each scenario stops independently on each sub-FCM, as FCM.run_fcm with the matrix engine.
+    fixed is a boolean mask of the columns held at their initial activation levels (None if all the nodes are updated).
+    Returns the final activation levels (the ones of the last iteration are discarded, as in FCM.run_fcm)."""
+    active = np.ones((values.shape[0], len(key_nodes)), dtype=bool)
+
+    for t in range(1, iterations):
+        c = 2 * values - 1
+        x = c @ ww_all + 2 * values - 1
+        new_values = np.round(sigmoid(x, lambda_all), 5)
+        if fixed is not None:
+            new_values[:, fixed] = values[:, fixed]
+
+        converged = np.abs(new_values[:, key_nodes] - values[:, key_nodes]) < threshold
+        update = active & ~converged
+        values = np.where(update[:, group], new_values, values)
+        active = update
+        if not active.any():
+            break
+
+    return values
+
+
+def solve_blocks(ww_all, lambda_all, group, key_nodes, values, iterations, threshold=0.001, solver="papageorgiou", fixed=None):
+    """run_fcm_blocks or solve_fixed_point on the block diagonal matrix ww_all, depending on solver, with the columns
+    of the boolean mask fixed held at their initial activation levels.
+    Returns the final activation levels and the (N x sub-FCMs) iterations and residuals (None with the papageorgiou solver)"""
+    if solver == "papageorgiou":
+        return run_fcm_blocks(ww_all, lambda_all, group, key_nodes, values, iterations, threshold, fixed), None, None
+    update = lambda a: sigmoid((2 * a - 1) @ ww_all + 2 * a - 1, lambda_all)
+    if fixed is not None:
+        update = lambda a: np.where(fixed, a, sigmoid((2 * a - 1) @ ww_all + 2 * a - 1, lambda_all))
+    return solve_fixed_point(update, values, iterations, threshold, solver, group)
+
+
+def solve_fixed_point(update, values, max_iter, threshold=0.001, solver="anderson", group=None, memory=5, cycle=8):
+    """Steady state A = update(A) of N scenarios at once, values is the (N x nodes) matrix of the initial activation levels.
+    group is the sub-FCM of each column (contiguous blocks of columns, a single one if None): each scenario stops
+    independently on each sub-FCM, when the error bound of update(A) (see error_bound, from the residual update(A) - A
+    of all its nodes in max norm and the contraction rate of the sub-FCM) is below threshold.
+    The iterations are not rounded. solver is 'picard' (A = update(A)), 'anderson' (Anderson mixing of the last memory
+    iterations) or 'aitken' (vector Aitken extrapolation of the last three of every cycle Picard iterations, the first
+    ones damp the fast modes); the extrapolations are computed on each sub-FCM separately.
+    Returns update(A) rounded to 5 decimals as the activation levels, and the (N x sub-FCMs) evaluations of update
+    and residuals."""
+    if solver not in solvers[1:]:
+        raise ValueError(f"Unknown fixed point solver: {solver}, expected one of {solvers[1:]}")
+    x = np.array(values, dtype=float)
+    group = np.zeros(x.shape[1], dtype=int) if group is None else np.asarray(group)
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])   # first column of each sub-FCM
+    blocks = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(group)]))
+    block_sum = lambda a: np.add.reduceat(a, starts, axis=1)
+
+    fx = update(x)
+    residual = np.maximum.reduceat(np.abs(fx - x), starts, axis=1)
+    iterations = np.ones(residual.shape, dtype=int)
+    rate = np.full(residual.shape, np.nan)  # contraction rate of each sub-FCM, unknown before the second evaluation
+    active = ~(error_bound(residual, rate) < threshold)
+    # update(A) and update(A) - A of the last memory iterations (a ring buffer), for Anderson
+    g_history = np.zeros(x.shape + (memory,))
+    f_history = np.zeros(x.shape + (memory,))
+    n_history = 0
+    chain = [x]     # Picard iterations since the last extrapolation, for Aitken
+
+    while active.any() and iterations.max() < max_iter:
+        # only the scenarios with a running sub-FCM are updated
+        rows = np.flatnonzero(active.any(axis=1))
+        x_rows, fx_rows = x[rows], fx[rows]
+        new_x = fx_rows
+        if solver == "anderson":
+            f = fx_rows - x_rows
+            m = min(n_history, memory)
+            if m > 0:
+                # minimize |f - dF gamma| over the differences of the last iterations, then A = update(A) - dG gamma
+                dG = fx_rows[:, :, None] - g_history[rows, :, :m]
+                dF = f[:, :, None] - f_history[rows, :, :m]
+                gram = block_sum(dF[:, :, :, None] * dF[:, :, None, :])
+                gram += np.eye(m) * (1e-10 * np.trace(gram, axis1=2, axis2=3)[:, :, None, None] + 1e-14)
+                gamma = np.linalg.solve(gram, block_sum(dF * f[:, :, None])[:, :, :, None])[:, :, :, 0]
+                new_x = fx_rows - (dG * gamma[:, blocks]).sum(axis=2)
+            g_history[rows, :, n_history % memory] = fx_rows
+            f_history[rows, :, n_history % memory] = f
+            n_history += 1
+        elif solver == "aitken":
+            chain.append(fx.copy())
+            if len(chain) == cycle + 1:
+                d1 = chain[-1][rows] - chain[-2][rows]
+                d2 = chain[-1][rows] - 2 * chain[-2][rows] + chain[-3][rows]
+                norm = block_sum(d2 * d2)
+                step = np.divide(block_sum(d2 * d1), norm, out=np.zeros(norm.shape), where=norm > 0)
+                new_x = fx_rows - step[:, blocks] * d1
+        # the activation levels of the extrapolations stay in the range of the sigmoid
+        running = active[rows][:, blocks]
+        x_previous, fx_previous = x_rows, fx_rows
+        x_rows = np.where(running, np.clip(new_x, 0, 1), x_rows)
+        fx_rows = np.where(running, update(x_rows), fx_rows)
+        x[rows], fx[rows] = x_rows, fx_rows
+        # secant estimate |update(A') - update(A)| / |A' - A| of the contraction rate, the largest one is kept
+        step = np.maximum.reduceat(np.abs(x_rows - x_previous), starts, axis=1)
+        change = np.maximum.reduceat(np.abs(fx_rows - fx_previous), starts, axis=1)
+        secant = np.divide(change, step, out=np.full(step.shape, np.nan), where=step > 0)
+        rate[rows] = np.where(active[rows], np.fmax(rate[rows], secant), rate[rows])
+        if len(chain) == cycle + 1:
+            chain = [x.copy()]
+        residual[rows] = np.where(active[rows], np.maximum.reduceat(np.abs(fx_rows - x_rows), starts, axis=1), residual[rows])
+        iterations[rows] += active[rows]
+        active &= ~(error_bound(residual, rate) < threshold)
+
+    return np.round(fx, 5), iterations, residual
@@ -1,6 +1,21 @@
 import numpy as np
-import skfuzzy as fuzz
-import matplotlib.pyplot as plt
+import bisect
+
+
+def trimf(x, abc):
+    "Triangular membership function of x with vertices abc (a <= b <= c), same values of skfuzzy.trimf"
+    a, b, c = abc
+    assert a <= b and b <= c, 'abc requires the three elements a <= b <= c.'
+    x = np.asarray(x, dtype=float)
+    y = np.zeros(len(x))
+    if a != b:
+        left = (a < x) & (x < b)
+        y[left] = (x[left] - a) / float(b - a)
+    if b != c:
+        right = (b < x) & (x < c)
+        y[right] = (c - x[right]) / float(c - b)
+    y[x == b] = 1
+    return y
 
 class Fuzzy_Linguistic_Terms:
     
@@ -8,6 +23,7 @@ class Fuzzy_Linguistic_Terms:
         self.range_values : np.array = range_values
         self.linguistic_terms : dict = linguistic_terms
         self.mfs = self.set_triangular_membership()
+        self.breakpoints, self.point_terms, self.interval_terms = self.set_classification_index()
 
     def set_triangular_membership(self):
         assert self.range_values is not None
@@ -15,11 +31,55 @@ class Fuzzy_Linguistic_Terms:
 
         mfs = {}
         for term in self.linguistic_terms.keys():
-            mfs[term] = fuzz.trimf(x = self.range_values, abc=self.linguistic_terms[term])
+            mfs[term] = trimf(self.range_values, self.linguistic_terms[term])
 
         return mfs
 
+    def get_memberships(self, values):
+        "Membership of each term (rows) for each value (columns), as fuzz.interp_membership"
+        values = np.asarray(values, dtype=float)
+        return np.array([np.interp(values, self.range_values, self.mfs[term], left=0.0, right=0.0) for term in self.linguistic_terms.keys()])
+
+    def classify_memberships(self, memberships):
+        "Term with the highest membership for each column, with the same tie-breaking of the original dict logic (the last term wins), None if no membership is positive"
+        terms = np.array(list(self.linguistic_terms.keys()) + [None], dtype=object)
+        n_terms = memberships.shape[0]
+        idx = n_terms - 1 - np.argmax(memberships[::-1], axis=0)
+        best = memberships[idx, np.arange(memberships.shape[1])]
+        idx[~(best > 0)] = n_terms
+        return terms[idx]
+
+    def set_classification_index(self):
+        """Sorted breakpoints of the classification, derived from the membership functions.
+        Between two breakpoints the memberships are linear and do not cross, so the term is constant.
+        Returns the breakpoints, the term of each breakpoint and the term of each interval (one more than the breakpoints)."""
+        assert self.mfs is not None
+
+        x = self.range_values
+        memberships = np.array([self.mfs[term] for term in self.linguistic_terms.keys()])
+
+        # candidates: the samples of the membership functions and the crossing points of each pair of terms
+        candidates = [x]
+        for i in range(len(memberships)):
+            for j in range(i+1, len(memberships)):
+                d = memberships[i] - memberships[j]
+                k = np.nonzero(d[:-1] * d[1:] < 0)[0]
+                candidates.append(x[k] + (x[k+1] - x[k]) * d[k] / (d[k] - d[k+1]))
+        breakpoints = np.unique(np.concatenate(candidates))
+
+        point_terms = self.classify_memberships(self.get_memberships(breakpoints))
+        inner = (breakpoints[:-1] + breakpoints[1:]) / 2
+        outer = np.array([breakpoints[0] - 1, breakpoints[-1] + 1])
+        interval_terms = self.classify_memberships(self.get_memberships(np.concatenate([outer[:1], inner, outer[1:]])))
+
+        # keep only the breakpoints where the term changes
+        keep = ~((point_terms == interval_terms[:-1]) & (point_terms == interval_terms[1:]))
+        interval_terms = np.concatenate([interval_terms[:1], interval_terms[1:][keep]])
+
+        return breakpoints[keep].tolist(), point_terms[keep].tolist(), interval_terms.tolist()
+
     def plot_triangle(self):
+        import matplotlib.pyplot as plt
         assert self.mfs is not None
 
         plt.figure()
@@ -49,18 +109,25 @@ class Fuzzy_Linguistic_Terms:
         plt.show(block=False)
 
     def get_linguisitic_term(self, value):
+        "Term with the highest membership for value, found with a binary search on the breakpoints"
         assert self.mfs is not None
 
-        vals = {}
-        for term in self.linguistic_terms.keys():
-            res = fuzz.interp_membership(self.range_values, self.mfs[term], value)
-            if res > 0:
-                vals[res] = term
-        if len(vals) > 0:
-            max_val = max(vals)
-            return vals[max_val]
-
-        return None
+        i = bisect.bisect_left(self.breakpoints, value)
+        if i < len(self.breakpoints) and self.breakpoints[i] == value:
+            return self.point_terms[i]
+        return self.interval_terms[i]
+
+    def get_linguistic_terms(self, values):
+        "Vectorized get_linguisitic_term, returns the list of terms of an array of values"
+        assert self.mfs is not None
+
+        values = np.asarray(values, dtype=float)
+        breakpoints = np.array(self.breakpoints)
+        i = np.searchsorted(breakpoints, values, side='left')
+        on_breakpoint = (i < len(breakpoints)) & (breakpoints[np.minimum(i, len(breakpoints) - 1)] == values)
+        point_terms = np.array(self.point_terms + [None], dtype=object)
+        interval_terms = np.array(self.interval_terms, dtype=object)
+        return np.where(on_breakpoint, point_terms[np.minimum(i, len(breakpoints))], interval_terms[i]).tolist()
 
     def get_value(self, term):
         assert self.mfs is not None
@@ -0,0 +1,87 @@
+import numpy as np
+import FLT_class
+import GA_operators
+from FCM_class_tool import activation_values, enabled_intermediate, run_fcm_batch
+
+iterations = 100  # number of iterations
+threshold = 0.001    # threshold
+solver = "papageorgiou"  # solver of the FCM, one of FCM_class_tool.solvers
+
+
+# class representing the population, adapted from GA_class.ArrayPopulation to the structure/activation_level format of the tool
+# an individual is the vector of the activation levels of the final nodes (genes) of the enabled sub-FCMs
+# rng is the random generator of the run (np.random.default_rng), the global state of numpy is never touched
+class Population(object):
+
+    def __init__(self, compiled, activation_level, flt:FLT_class.Fuzzy_Linguistic_Terms, pop_size=50, crossover_prob=0.7, retain=15, target_val=0.9, rng=None):
+        self.compiled = compiled
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.pop_size = pop_size
+        self.crossover_prob = crossover_prob
+        self.retain = retain
+        self.target_val = target_val
+        self.fitness_history = []
+        self.ind_fitness_history = []
+        self.done = False
+        self.values = np.array(sorted([flt.get_value(x) for x in flt.linguistic_terms.keys()][1:]))
+
+        # genes are the final nodes of the enabled sub-FCMs, all the individuals start from the current activation levels
+        self.enabled = enabled_intermediate(compiled, activation_level)
+        self.gene_ids = np.array([n for node_id in self.enabled for n in compiled["sub_fcms"][node_id]["nodes"][1:]], dtype=int)
+        self.initial_values = activation_values(compiled, activation_level, flt)
+        self.genes = np.tile(self.initial_values[self.gene_ids], (pop_size, 1))
+        self.fitness_vals = np.zeros(pop_size)
+
+    # initial activation levels of all the nodes for each row of genes
+    def node_values(self, genes):
+        values = np.tile(self.initial_values, (len(genes), 1))
+        values[:, self.gene_ids] = genes
+        return values
+
+    # Grade the generation with one batched FCM run on the distinct gene vectors
+    def grade(self):
+        unique_genes, inverse = np.unique(np.round(self.genes, 5), axis=0, return_inverse=True)
+        results, _ = run_fcm_batch(self.compiled, self.node_values(unique_genes), self.enabled, iterations, threshold, solver=solver)
+        self.fitness_vals = np.round(np.abs(self.target_val - results), 3)[inverse.reshape(-1)]
+
+        fitness_sum = round(float(sum(self.fitness_vals.tolist())), 3)
+        pop_fitness = round(fitness_sum / self.pop_size, 3)
+        self.fitness_history.append(pop_fitness)
+
+        # sort individuals by fitness (lower fitness it better in this case)
+        order = np.argsort(self.fitness_vals, kind='stable')
+        self.genes = self.genes[order]
+        self.fitness_vals = self.fitness_vals[order]
+        self.ind_fitness_history.append(float(self.fitness_vals[0]))
+
+        # set done to True if the target value is reached or if the fitness is too low
+        if pop_fitness < 0.03 or self.fitness_vals[0] < 0.03:
+            self.done = True
+
+    # elitist selection, one-point crossover of distinct parents and mutation of one of the lowest genes (the operators of GA_class.ArrayPopulation)
+    def evolve(self):
+        parents = GA_operators.select(self.genes, self.retain)
+        self.genes = GA_operators.crossover(self.genes, parents, parents.copy(), self.pop_size, self.crossover_prob, self.rng)
+        GA_operators.mutation(self.genes, self.values, self.rng)
+
+
+class ALGA_class():
+
+    # execute the what-if analysis on a structure, one independent run for each seed
+    # returns, for each run, the final activation levels of the nodes (indexed by node id) reached with the best individual and its fitness
+    def what_if(compiled, activation_level, flt, target_val, seeds, pop_size=50, generation=250, retain=15, crossover_prob=0.7):
+        results = []
+        for seed in seeds:
+            rng = np.random.default_rng(seed)
+            pop = Population(compiled, activation_level, flt, pop_size=pop_size, crossover_prob=crossover_prob, retain=retain, target_val=target_val, rng=rng)
+            for x in range(generation):
+                pop.grade()
+                if pop.done or x == generation - 1:
+                    break
+                pop.evolve()
+
+            # inference on the best individual
+            best_values = pop.node_values(pop.genes[:1])
+            _, final_values = run_fcm_batch(compiled, best_values, pop.enabled, iterations, threshold, solver=solver)
+            results.append((final_values[0], pop.fitness_vals[0], pop.enabled))
+        return results
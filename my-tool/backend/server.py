@@ -1,27 +1,45 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from FCM_class_tool import FCM
+from FCM_class_tool import FCM, get_compiled_structure, structure_hash, activation_values, enabled_intermediate, run_fcm_batch, load_compiled_structure
+from GA_class_tool import ALGA_class
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import OrderedDict
 import FLT_class
 import json
 import copy
+import uuid
+import glob
+import hashlib
+import threading
+import time
+import numpy as np
 
 app = Flask(__name__)
 CORS(app, origins=['http://localhost:3000'])  
 
+# fuzzy linguistic terms, built once per process
+flt = FLT_class.define_al_fuzzy()
+
+# structures compiled ahead of time (see utils/compile_model.py) are loaded at startup and never compiled again
+for compiled_file in glob.glob('*.fcmb'):
+    load_compiled_structure(compiled_file)
+
 @app.route('/inference', methods=['POST'])
 def execute_python():
     try:
         data = request.get_json()
         structure = data.get('structure')
         activation_level = data.get('activation_level')
+        solver = data.get('solver', 'papageorgiou')
 
-        flt = FLT_class.define_al_fuzzy()
         iterations = 100 
         threshold = 0.001
 
-        fcm_obj = FCM(iterations, structure, activation_level, flt)
+        # the structure is compiled only the first time it is seen, only the activation levels are new
+        compiled = get_compiled_structure(structure)
+        fcm_obj = FCM(iterations, structure, activation_level, flt, compiled=compiled)
         print("FCM object created")
-        fcm_obj.run_fcm(threshold)
+        fcm_obj.run_fcm(threshold, engine="matrix", trajectories=False, solver=solver)
         json_output = fcm_obj.generate_al_values()
         #print("output FCM:", json_output)
                 
@@ -35,62 +53,169 @@ def execute_python():
                 'numeric_weight': final_data[node['id']]['numeric_weight']
                 })
 
-        return jsonify({'message': 'Script executed successfully', 'graphData': single_data}), 200
+        # iterations and residual (fixed point solvers only) of each sub-FCM
+        solver_stats = {'solver': solver, 'iterations': {}, 'residual': {}}
+        for node_id, stats in fcm_obj.solver_stats.items():
+            solver_stats['iterations'][node_id] = stats['iterations']
+            solver_stats['residual'][node_id] = stats['residual']
+
+        return jsonify({'message': 'Script executed successfully', 'graphData': single_data, 'solverStats': solver_stats}), 200
     except Exception as e:
         print("Errore durante l'esecuzione:", str(e))
         return jsonify({'error': str(e)}), 500
 
-@app.route('/simulation', methods=['POST'])
-def execute_simulation():
+@app.route('/inference/batch', methods=['POST'])
+def execute_batch():
     try:
         data = request.get_json()
         structure = data.get('structure')
-        activation_level = data.get('activation_level')
+        activation_levels = data.get('activation_levels')
+        solver = data.get('solver', 'papageorgiou')
 
-        #flt = FLT_class.define_al_fuzzy()
-        #iterations = 100 
-        #threshold = 0.001
-        
-        open_file = open('final_al1.json', 'r')
-        json_output1 = open_file.read()
-        json_output1 = json.loads(json_output1)
-        open_file.close()
-        #print("output 1 FCM:", json_output1)
-
-        open_file = open('final_al2.json', 'r')
-        json_output2 = open_file.read()
-        json_output2 = json.loads(json_output2)
-        open_file.close()
-        #print("output 2 FCM:", json_output2)
-
-        single_data1 = copy.deepcopy(structure)
-        final_data1 = {node['id']: node for node in json_output1}
-        single_data2 = copy.deepcopy(structure)
-        final_data2 = {node['id']: node for node in json_output2}
-
-        for node in single_data1['nodes']:
-            if node['id'] in final_data1:
-                node.update({
-                'weight': final_data1[node['id']]['weight'],
-                'numeric_weight': final_data1[node['id']]['numeric_weight']
-                })
+        iterations = 100
+        threshold = 0.001
+
+        compiled = get_compiled_structure(structure)
+        node_ids = [compiled['root']] + compiled['intermediate'] + compiled['final']
+        values = np.array([activation_values(compiled, activation_level, flt) for activation_level in activation_levels])
+
+        # scenarios with the same enabled sub-FCMs are run together with the batched matrix engine
+        groups = {}
+        for i, activation_level in enumerate(activation_levels):
+            groups.setdefault(tuple(enabled_intermediate(compiled, activation_level)), []).append(i)
+
+        results = [None] * len(activation_levels)
+        for enabled, rows in groups.items():
+            _, final_values, stats = run_fcm_batch(compiled, values[rows], list(enabled), iterations, threshold, solver=solver, return_stats=True)
+            visible = [compiled['root']] + [n for node_id in enabled for n in compiled['sub_fcms'][node_id]['nodes']]
+            columns = final_values[:, node_ids]
+            terms = flt.get_linguistic_terms(columns)
+            mask = np.isin(node_ids, visible)
+            for k, i in enumerate(rows):
+                # nodes of the disabled sub-FCMs have no activation level
+                results[i] = {
+                'weight': [terms[k][j] if mask[j] else None for j in range(len(node_ids))],
+                'numeric_weight': [float(columns[k][j]) if mask[j] else None for j in range(len(node_ids))],
+                # largest iterations and residual over the sub-FCMs (fixed point solvers only)
+                'iterations': int(stats['iterations'][k].max()) if stats['iterations'] is not None else None,
+                'residual': float(stats['residual'][k].max()) if stats['residual'] is not None else None
+                }
+
+        # the nodes are listed once, the results of each scenario follow the same order
+        nodes = [{'id': n, 'label': ", ".join(compiled['all_nodes'][n]['meanings'])} for n in node_ids]
+        return jsonify({'message': 'Script executed successfully', 'nodes': nodes, 'results': results}), 200
+    except Exception as e:
+        print("Errore durante l'esecuzione:", str(e))
+        return jsonify({'error': str(e)}), 500
+
+# to-be simulations run as jobs in a background thread, so the GA never blocks the Flask worker
+simulation_executor = ThreadPoolExecutor(max_workers=1)
+simulation_jobs = OrderedDict()     # job id -> (creation time, future or result of the simulation), oldest first
+simulation_pending = {}             # hash of the request -> future of the running simulation, shared by identical requests
+simulation_results = OrderedDict()  # hash of the request -> graphData, so identical requests are served from the cache
+simulation_lock = threading.Lock()  # the jobs are created by the Flask workers and completed by the executor
+simulation_job_ttl = 3600   # seconds after which a job (running or finished) is removed
+max_simulation_results = 32 # simulations kept in simulation_results, the least recently used are removed
+n_alternatives = 2          # number of alternative to-be scenarios (independent GA runs)
+
+
+def expire_simulation_jobs():
+    "Remove the jobs created more than simulation_job_ttl seconds ago, the only removal of the jobs (call with simulation_lock held)"
+    now = time.monotonic()
+    while len(simulation_jobs) > 0 and now - next(iter(simulation_jobs.values()))[0] > simulation_job_ttl:
+        simulation_jobs.popitem(last=False)
+
+
+def simulation_key(structure, activation_level, global_weight):
+    "Key of a simulation request: the topology of the structure (see structure_hash), the activation levels and the target"
+    request = json.dumps({'activation_level': activation_level, 'global_weight': global_weight}, sort_keys=True)
+    return structure_hash(structure) + hashlib.sha256(request.encode()).hexdigest()
 
-        for node in single_data2['nodes']:
-            if node['id'] in final_data2:
+
+def run_simulation(structure, activation_level, global_weight, key):
+    """Run the GA on the posted structure and return one structure with the to-be activation levels for each alternative.
+    The result replaces the pending simulation of the key in simulation_results (a failed simulation is only removed)."""
+    graph_data = None
+    try:
+        graph_data = simulate(structure, activation_level, global_weight)
+    finally:
+        with simulation_lock:
+            if graph_data is not None:
+                simulation_results[key] = graph_data
+                if len(simulation_results) > max_simulation_results:
+                    simulation_results.popitem(last=False)
+            simulation_pending.pop(key, None)
+    return graph_data
+
+
+def simulate(structure, activation_level, global_weight):
+    "To-be scenarios of the structure: n_alternatives runs of the GA reaching global_weight"
+    compiled = get_compiled_structure(structure)
+    target_val = flt.get_value(global_weight)
+    results = ALGA_class.what_if(compiled, activation_level, flt, target_val, seeds=list(range(n_alternatives)))
+
+    graph_data = []
+    for final_values, fitness, enabled in results:
+        single_data = copy.deepcopy(structure)
+        visible = set([compiled['root']] + [n for node_id in enabled for n in compiled['sub_fcms'][node_id]['nodes']])
+        for node in single_data['nodes']:
+            if node['id'] in visible:
                 node.update({
-                'weight': final_data2[node['id']]['weight'],
-                'numeric_weight': final_data2[node['id']]['numeric_weight']
+                'weight': flt.get_linguisitic_term(final_values[node['id']]),
+                'numeric_weight': round(float(final_values[node['id']]), 5)
                 })
+        if 'transitions' not in single_data:
+            single_data['transitions'] = []
+        graph_data.append(single_data)
+    return graph_data
+
+
+@app.route('/simulation', methods=['POST'])
+def execute_simulation():
+    try:
+        data = request.get_json()
+        structure = data.get('structure')
+        activation_level = data.get('activation_level')
+        global_weight = data.get('global_weight', 'VH')
+
+        job_id = uuid.uuid4().hex
+        key = simulation_key(structure, activation_level, global_weight)
+        with simulation_lock:
+            expire_simulation_jobs()
+            if key in simulation_results:
+                simulation_results.move_to_end(key)
+                job = simulation_results[key]
+            elif key in simulation_pending:
+                job = simulation_pending[key]   # an identical simulation is queued or running, the job waits for it
+            else:
+                job = simulation_pending[key] = simulation_executor.submit(run_simulation, structure, activation_level, global_weight, key)
+            simulation_jobs[job_id] = (time.monotonic(), job)
 
-        for single_data in [single_data1, single_data2]:
-            if 'transitions' not in single_data:
-                single_data['transitions'] = []
+        return jsonify({'message': 'Simulation started', 'job_id': job_id}), 202
 
-        return jsonify({'message': 'Script executed successfully', 'graphData': [single_data1, single_data2]}), 200
-        
     except Exception as e:
         print("Errore durante l'esecuzione:", str(e))
         return jsonify({'error': str(e)}), 500
-        
+
+
+@app.route('/simulation/<job_id>', methods=['GET'])
+def simulation_status(job_id):
+    with simulation_lock:
+        expire_simulation_jobs()
+        if job_id not in simulation_jobs:
+            return jsonify({'error': f'Unknown job: {job_id}'}), 404
+        _, job = simulation_jobs[job_id]
+
+    # finished jobs are kept until they expire, so a client can poll them again
+    if isinstance(job, Future):
+        if not job.done():
+            return jsonify({'status': 'running', 'job_id': job_id}), 200
+        if job.exception() is not None:
+            print("Errore durante l'esecuzione:", str(job.exception()))
+            return jsonify({'status': 'error', 'error': str(job.exception())}), 500
+        job = job.result()
+
+    return jsonify({'status': 'done', 'message': 'Script executed successfully', 'graphData': job}), 200
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
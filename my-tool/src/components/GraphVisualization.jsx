@@ -887,8 +887,23 @@ const nodeConnections = useMemo(() => { // Crea un oggetto che mappa gli ID dei
         body: JSON.stringify({ structure, activation_level, global_weight: selectedGlobalWeight }),
       });
 
-      if (response.ok) {
-        const result = await response.json();
+      if (!response.ok) {
+        const error = await response.json();
+        alert(`Error: ${error.error}`);
+        return;
+      }
+
+      // La simulazione viene eseguita come job asincrono: si interroga il backend finché il risultato non è pronto
+      const { job_id } = await response.json();
+      let jobResponse;
+      let result;
+      do {
+        await new Promise(resolve => setTimeout(resolve, 500));
+        jobResponse = await fetch(`http://localhost:5000/simulation/${job_id}`);
+        result = await jobResponse.json();
+      } while (jobResponse.ok && result.status === 'running');
+
+      if (jobResponse.ok) {
         alert(result.message);
 
         const enabledIntermediateIds = outputNodes
@@ -917,8 +932,7 @@ const nodeConnections = useMemo(() => { // Crea un oggetto che mappa gli ID dei
           generatedGraphRef.current?.scrollIntoView({ behavior: 'smooth', block: 'center' });
         }, 100);
       } else {
-        const error = await response.json();
-        alert(`Error: ${error.error}`);
+        alert(`Error: ${result.error}`);
       }
     } catch (error) {
       alert('An error occurred while executing the Python script.');
@@ -0,0 +1,69 @@
+import sys
+import os
+
+# run from the root of the repository: python -m pytest tests
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+os.chdir(root_path)
+
+import numpy as np
+import pytest
+import FLT_class
+import FCM_class
+from FCM_class import FCM
+
+lambdas = {
+    1: 0.83,
+    2: 0.85,
+    3: 0.81,
+    4: 0.91,
+    5: 0.735
+}
+n_fcm = 5
+iterations = 100
+threshold = 0.001
+flt = FLT_class.define_al_fuzzy()
+
+
+def run(company, engine, trajectories=True):
+    fcm_obj = FCM(n_fcm, iterations, dict(lambdas), company, flt)
+    fcm_obj.run_fcm(threshold, engine=engine, trajectories=trajectories)
+    return fcm_obj
+
+
+@pytest.mark.parametrize("company", ["mix", "case_study"])
+def test_engines(company):
+    graph = run(company, "graph")
+    matrix = run(company, "matrix")
+    final = run(company, "matrix", trajectories=False)
+    batch, batch_finals = FCM_class.run_fcm_batch([company], n_fcm, iterations, lambdas, flt, threshold, return_finals=True)
+
+    # same trajectories of the graph and matrix engines
+    graph_trajectories, matrix_trajectories = graph.aligned_trajectories(), matrix.aligned_trajectories()
+    assert graph_trajectories.keys() == matrix_trajectories.keys()
+    for key in graph_trajectories:
+        np.testing.assert_allclose(matrix_trajectories[key], graph_trajectories[key], atol=1e-9)
+
+    # same final activation levels of all the engines
+    for fcm_obj in (matrix, final):
+        assert fcm_obj.final_values.keys() == graph.final_values.keys()
+        for key in graph.final_values:
+            np.testing.assert_allclose(fcm_obj.final_values[key], graph.final_values[key], atol=1e-9)
+        assert fcm_obj.main_final_al == pytest.approx(graph.main_final_al, abs=1e-9)
+    assert batch_finals.keys() == graph.final_values.keys()
+    for key in graph.final_values:
+        np.testing.assert_allclose(batch_finals[key][0], graph.final_values[key], atol=1e-9)
+    assert batch[0] == pytest.approx(graph.main_final_al, abs=1e-9)
+
+
+def test_linguistic_terms():
+    values = np.concatenate([
+        np.random.default_rng(0).uniform(-0.1, 1.1, 2000),
+        flt.breakpoints,
+        flt.range_values,
+        [-1.0, 0.0, 1.0, 2.0]
+    ])
+    terms = flt.get_linguistic_terms(values)
+    assert terms == [flt.get_linguisitic_term(value) for value in values]
+    # and the term with the highest membership, as the membership functions classify the values
+    assert terms == flt.classify_memberships(flt.get_memberships(values)).tolist()
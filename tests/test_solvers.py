@@ -0,0 +1,49 @@
+import sys
+import os
+
+# run from the root of the repository: python -m pytest tests
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+os.chdir(root_path)
+
+import numpy as np
+import pytest
+import FLT_class
+import FCM_class
+from FCM_class import FCM
+
+lambdas = {
+    1: 0.83,
+    2: 0.85,
+    3: 0.81,
+    4: 0.91,
+    5: 0.735
+}
+n_fcm = 5
+threshold = 0.001
+flt = FLT_class.define_al_fuzzy()
+
+
+def converged_state(fcm_obj, key, tolerance=1e-12, max_iter=1000000):
+    "Papageorgiou update of a sub-FCM iterated until it stops changing, without rounding the activation levels"
+    ww, values = fcm_obj.weight_operators[key], fcm_obj.initial_values[key].astype(float)
+    for _ in range(max_iter):
+        new_values = FCM.sigmoid((2 * values - 1) @ ww + 2 * values - 1, fcm_obj.lambdas[key])
+        if np.abs(new_values - values).max() < tolerance:
+            break
+        values = new_values
+    return new_values
+
+
+# the maps of mix have a sub-FCM not contracting around its state, without a unique steady state to compare with
+@pytest.mark.parametrize("company", ["case_study", "naive", "advanced"])
+@pytest.mark.parametrize("solver", FCM_class.solvers[1:])
+def test_fixed_point_solvers(company, solver):
+    reference = FCM(n_fcm, 100, dict(lambdas), company, flt)
+    # picard contracts as slowly as the map, it needs more evaluations than the other solvers
+    fcm_obj = FCM(n_fcm, 100000 if solver == "picard" else 100, dict(lambdas), company, flt)
+    fcm_obj.run_fcm(threshold, engine="matrix", trajectories=False, solver=solver)
+    batch = FCM_class.run_fcm_batch([company], n_fcm, fcm_obj.iterations, lambdas, flt, threshold, solver=solver)
+    for key in fcm_obj.final_values:
+        assert np.abs(fcm_obj.final_values[key] - converged_state(reference, key)).max() < threshold
+    assert abs(batch[0] - fcm_obj.main_final_al) < threshold
@@ -0,0 +1,46 @@
+import sys
+import os
+import json
+
+# run from the root of the repository: python utils/compile_model.py
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+tool_path = os.path.join(root_path, "my-tool", "backend")
+sys.path.insert(0, root_path)
+sys.path.append(tool_path)
+
+import FCM_class
+import FCM_class_tool
+import FCM_binary
+
+
+def frontend_structure(structure):
+    "Structure as sent by the frontend to /inference: the nodes carry the activation levels and the positions of the graph"
+    nodes = [dict(node, weight="NA", numeric_weight=0.5, index=i, x=0.0, y=0.0, vx=0.0, vy=0.0) for i, node in enumerate(structure["nodes"])]
+    transitions = [dict(elem, index=i) for i, elem in enumerate(structure["transitions"])]
+    return {"nodes": nodes, "transitions": transitions}
+
+
+if __name__ == "__main__":
+    # same lambdas of FCM_class and GA_class
+    lambdas = {
+        1: 0.83,
+        2: 0.85,
+        3: 0.81,
+        4: 0.91,
+        5: 0.735
+    }
+    company = "case_study"  # case from which the links between the maps are read
+
+    # model of the evaluation (model/*_wm.csv and model/*_desc.json), used by FCM_class instead of the text files
+    output = FCM_class.compile_model(lambdas=lambdas, company_type=company)
+    print(f"Model compiled in {output}")
+
+    # structure of the tool, loaded by the backend at startup
+    structure = json.load(open(os.path.join(root_path, "my-tool", "single_file.json")))
+    output = FCM_class_tool.save_compiled_structure(structure, os.path.join(tool_path, "single_file.fcmb"))
+    print(f"Structure compiled in {output}")
+
+    # the requests of the frontend must find the preloaded structure, so they must have the hash of the file
+    header, _ = FCM_binary.read_model(output)
+    assert FCM_class_tool.structure_hash(frontend_structure(structure)) == header["structure_hash"], \
+        f"the structures sent by the frontend do not match {output}"
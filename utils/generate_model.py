@@ -0,0 +1,145 @@
+import sys
+import os
+import json
+import argparse
+import numpy as np
+
+# run from the root of the repository: python utils/generate_model.py --help
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+
+import FCM_class
+
+terms = ['VL', 'L', 'M', 'H', 'VH']
+
+
+def generate_model(depth=2, branching=5, nodes_per_map=9, density=0.3, seed=0):
+    """Generate a synthetic hierarchy of maps with the same layout of model/ and cases/:
+    the root map (layer 1, idx 0) links branching maps of layer 2, and so on down to the leaf maps of layer depth,
+    which have nodes_per_map nodes (the main concept and the technologies).
+    Every technology has an edge to the main concept of its map, the technologies are linked to each other
+    with probability density; the weights are scaled so that the expected input of a node does not grow with the map.
+    Returns the model (idx -> {"desc", "ww"}), the case (idx -> rows [linguistic term, link]) and the lambdas of the maps."""
+    assert depth >= 2 and branching >= 1 and nodes_per_map >= 2
+    rng = np.random.default_rng(seed)
+    model = {}
+    case = {}
+    lambdas = {}
+
+    # maps of each layer, numbered breadth first
+    layers = [[0]]
+    for layer in range(1, depth):
+        first = layers[-1][-1] + 1
+        layers.append(list(range(first, first + len(layers[-1]) * branching)))
+
+    for layer, maps in enumerate(layers):
+        for position, idx in enumerate(maps):
+            lambdas[idx] = round(float(rng.uniform(0.7, 0.95)), 3)
+            if layer < depth - 1:
+                # the linked nodes feed the output node of the map (the last one in the root map, as in model/0_wm.csv)
+                children = layers[layer + 1][position * branching:(position + 1) * branching]
+                n = branching + 1
+                output = n - 1 if idx == 0 else 0
+                linked = [x for x in range(n) if x != output]
+                ww = np.zeros((n, n))
+                ww[linked, output] = np.round(rng.uniform(0.5, 1, branching), 5)
+                names = {x: f"Map {child}" for x, child in zip(linked, children)}
+                names[output] = "Root" if idx == 0 else f"Map {idx}"
+                links = {x: child for x, child in zip(linked, children)}
+            else:
+                # the main concept is node 0, the technologies follow
+                n = nodes_per_map
+                scale = min(1.0, 4.0 / max(1.0, density * (n - 2)))
+                ww = np.where(rng.random((n, n)) < density, rng.random((n, n)) * scale, 0.0)
+                ww[0, :] = 0    # the main concept has no outgoing edges, as in model/
+                ww[1:, 0] = rng.uniform(0.1, 1, n - 1) * min(1.0, 8.0 / (n - 1))
+                np.fill_diagonal(ww, 0)
+                ww = np.round(ww, 5)
+                names = {0: f"Map {idx}"}
+                names.update({x: f"Technology {idx}.{x}" for x in range(1, n)})
+                links = {}
+
+            desc = {"main": names[output] if layer < depth - 1 else names[0], "nodes": {str(x + 1): names[x] for x in range(n)}}
+            if idx != 0:
+                desc["weight"] = 1
+            desc["layer"] = layer + 1
+            model[idx] = {"desc": desc, "ww": ww}
+
+            # the main concepts and the linked nodes have no activation level
+            rows = []
+            for x in range(n):
+                if x in links or names[x] == desc["main"]:
+                    rows.append(["NA", links.get(x, 0)])
+                else:
+                    rows.append([str(rng.choice(terms)), 0])
+            case[idx] = rows
+
+    return model, case, lambdas
+
+
+def write_model(model, case, lambdas, path, company_type="synthetic"):
+    """Write a generated model in path/model (desc and weight matrices, compiled with the lambdas and the links)
+    and the activation levels in path/cases/company_type"""
+    model_dir = os.path.join(path, "model")
+    case_dir = os.path.join(path, "cases", company_type)
+    os.makedirs(model_dir, exist_ok=True)
+    os.makedirs(case_dir, exist_ok=True)
+    for idx in model:
+        with open(os.path.join(model_dir, f"{idx}_desc.json"), "w") as f:
+            json.dump(model[idx]["desc"], f, indent=4)
+        np.savetxt(os.path.join(model_dir, f"{idx}_wm.csv"), model[idx]["ww"], delimiter=",", fmt="%.10g")
+        with open(os.path.join(case_dir, f"{idx}_al.csv"), "w") as f:
+            f.writelines(f"{term},{link}\n" for term, link in case[idx])
+    FCM_class.compile_model(model_dir, lambdas=lambdas, company_type=company_type, cases=os.path.join(path, "cases"))
+
+
+def to_structure(model, case, lambdas):
+    """Structure (as my-tool/single_file.json) and activation levels (as the ones posted to /inference) of a generated model.
+    Only models with two layers can be represented: the root, the intermediate nodes (the main concepts of the leaf maps)
+    and the final nodes (the technologies)."""
+    root_desc = model[0]["desc"]
+    if any(model[idx]["desc"]["layer"] > 2 for idx in model):
+        raise ValueError("The structure of the tool has only two layers")
+    nodes = [{"id": 0, "role": "root", "meanings": [root_desc["main"]], "targets": []}]
+    transitions = []
+    activation_level = [{"id": 0, "label": root_desc["main"], "weight": "NA"}]
+
+    # intermediate nodes keep the idx of their map, the final nodes follow
+    maps = sorted(idx for idx in model if idx != 0)
+    next_id = max(maps) + 1
+    for idx in maps:
+        ww = model[idx]["ww"]
+        ids = [idx] + list(range(next_id, next_id + ww.shape[0] - 1))
+        next_id += ww.shape[0] - 1
+        nodes.append({"id": idx, "role": "intermediate", "meanings": [model[idx]["desc"]["main"]], "targets": [0], "lambda": lambdas[idx]})
+        transitions.append({"from": idx, "to": 0, "weight": 1})
+        activation_level.append({"id": idx, "label": model[idx]["desc"]["main"], "weight": "NA", "enabled": True})
+        for a in range(1, ww.shape[0]):
+            targets = [ids[b] for b in range(ww.shape[0]) if ww[a][b] != 0]
+            name = model[idx]["desc"]["nodes"][str(a + 1)]
+            nodes.append({"id": ids[a], "role": "final", "meanings": [name], "targets": targets})
+            transitions.extend({"from": ids[a], "to": ids[b], "weight": float(ww[a][b])} for b in range(ww.shape[0]) if ww[a][b] != 0)
+            activation_level.append({"id": ids[a], "label": name, "weight": case[idx][a][0]})
+    return {"nodes": nodes, "transitions": transitions}, activation_level
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic model with the layout of model/ and cases/")
+    parser.add_argument("output", help="output directory (model/, cases/synthetic/, single_file.json and current_al.json)")
+    parser.add_argument("--depth", type=int, default=2, help="number of layers")
+    parser.add_argument("--branching", type=int, default=5, help="maps linked by each map of the upper layers")
+    parser.add_argument("--nodes", type=int, default=9, help="nodes of each leaf map")
+    parser.add_argument("--density", type=float, default=0.3, help="probability of an edge between two technologies")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model, case, lambdas = generate_model(args.depth, args.branching, args.nodes, args.density, args.seed)
+    write_model(model, case, lambdas, args.output)
+    n_nodes = sum(model[idx]["ww"].shape[0] for idx in model)
+    print(f"Generated {len(model)} maps and {n_nodes} nodes in {args.output}")
+    if args.depth == 2:
+        structure, activation_level = to_structure(model, case, lambdas)
+        with open(os.path.join(args.output, "single_file.json"), "w") as f:
+            json.dump(structure, f, indent=4)
+        with open(os.path.join(args.output, "current_al.json"), "w") as f:
+            json.dump(activation_level, f, indent=4)